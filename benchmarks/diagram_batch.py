@@ -0,0 +1,55 @@
+"""
+Wall time of a batch rebuild: one interpreter launch per diagram against
+convert_many with 1..N worker processes.
+
+    python benchmarks/diagram_batch.py --files 24 --shapes 20000 --jobs 1 2 4 8
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import diagram_converter
+from diagram_ingest import generate_diagram
+
+CONVERTER = os.path.join(os.path.dirname(__file__), '..', 'diagram_converter.py')
+
+
+def launch_each(inputs, out_dir):
+    for input_file, output_file in diagram_converter.plan_outputs(inputs, out_dir).items():
+        subprocess.run([sys.executable, CONVERTER, input_file, output_file], check=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=24)
+    parser.add_argument('--shapes', type=int, default=20000)
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inputs = []
+        for index in range(args.files):
+            path = os.path.join(tmp, f'campaign-{index}.csv')
+            generate_diagram(path, args.shapes, seed=index)
+            inputs.append(path)
+        out_dir = os.path.join(tmp, 'out')
+        os.makedirs(out_dir)
+
+        print(f"{'mode':<16} {'wall s':>8}")
+        start = time.perf_counter()
+        launch_each(inputs, out_dir)
+        print(f"{'one process each':<16} {time.perf_counter() - start:>8.2f}")
+        outputs = diagram_converter.plan_outputs(inputs, out_dir)
+        for jobs in sorted(set(args.jobs)):
+            start = time.perf_counter()
+            results = diagram_converter.convert_many(outputs, jobs=jobs)
+            elapsed = time.perf_counter() - start
+            failed = sum(1 for result in results if not result['ok'])
+            print(f"{f'--jobs {jobs}':<16} {elapsed:>8.2f}" + (f'  {failed} failed' if failed else ''))
+
+if __name__ == '__main__':
+    main()
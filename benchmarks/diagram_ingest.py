@@ -0,0 +1,134 @@
+"""
+Time and peak memory of reading and converting Lucidchart CSV exports.
+
+Synthetic call-flow diagrams are generated from a fixed seed: process
+sections with jump/hide/content comments, chains of Yes/No decisions and
+direct process-to-process links, in the same CSV layout Lucidchart exports.
+Each size is read with read_diagram (rows go straight into the node and edge
+store) and with read_diagram_file (a list of shape dicts first), then
+converted to markdown; the pipeline path streams the sections of the
+read_diagram result to /dev/null without building the document.
+
+    python benchmarks/diagram_ingest.py --sizes 10000 100000 1000000
+"""
+import argparse
+import csv
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import diagram_converter
+
+COLUMNS = [
+    'Id', 'Name', 'Shape Library', 'Page ID', 'Contained By', 'Group', 'Line Source',
+    'Line Destination', 'Source Arrow', 'Destination Arrow', 'Status', 'Text Area 1', 'Comments'
+]
+AUTHOR = 'Jeremy Villalobos'
+
+
+def comment_json(rng, index):
+    comments = []
+    if rng.random() < 0.8:
+        comments.append({'Creator': AUTHOR, 'Content': f'jump: Let me ask about topic {index}.'})
+    if rng.random() < 0.6:
+        comments.append({'Creator': AUTHOR, 'Content': f'Explain option {index} to the caller and wait for an answer.'})
+    if rng.random() < 0.03:
+        comments.append({'Creator': AUTHOR, 'Content': 'hide: internal note'})
+    if rng.random() < 0.3:
+        comments.append({'Creator': 'Someone Else', 'Content': 'Looks good to me'})
+    return json.dumps([{'Comments': comments}]) if comments else ''
+
+def generate_rows(shapes, seed=7):
+    """
+    Yield CSV rows for a diagram of about `shapes` shapes.
+    """
+    rng = random.Random(seed)
+    yield COLUMNS
+    yield ['1', 'Page', '', '', '', '', '', '', '', '', '', 'Page 1', '']
+    next_id = 2
+    # Each section is a process, a chain of decisions and their lines;
+    # about 8 shapes per section on average.
+    sections = max(2, shapes // 8)
+    process_ids = [str(next_id + i) for i in range(sections)]
+    next_id += sections
+
+    def line(source, target, text=''):
+        nonlocal next_id
+        next_id += 1
+        return [str(next_id - 1), 'Line', '', '1', '', '', source, target, 'None', 'Arrow', '', text, '']
+
+    for index, process_id in enumerate(process_ids):
+        kind = 'Terminator' if rng.random() < 0.05 else 'Process'
+        yield [process_id, kind, 'Flowchart Shapes', '1', '', '', '', '', '', '', '',
+               f'Section {index}', comment_json(rng, index)]
+        if kind == 'Terminator':
+            continue
+        if rng.random() < 0.2:
+            yield line(process_id, rng.choice(process_ids))
+            continue
+        previous = process_id
+        for depth in range(rng.randint(1, 3)):
+            decision_id = str(next_id)
+            next_id += 1
+            yield [decision_id, 'Decision', 'Flowchart Shapes', '1', '', '', '', '', '', '', '',
+                   f'If the caller wants option {index}.{depth}', '']
+            yield line(previous, decision_id, '' if depth == 0 else 'No')
+            yield line(decision_id, rng.choice(process_ids), 'Yes')
+            previous = decision_id
+        yield line(previous, rng.choice(process_ids), 'No')
+
+def generate_diagram(path, shapes, seed=7):
+    with open(path, 'w', newline='') as f:
+        csv.writer(f).writerows(generate_rows(shapes, seed))
+
+def measure(function, *args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def convert_streaming(path):
+    return diagram_converter.convert_lucid_diagram_to_md(diagram_converter.read_diagram(path))
+
+def convert_dicts(path):
+    return diagram_converter.convert_lucid_diagram_to_md(diagram_converter.read_diagram_file(path))
+
+def convert_pipeline(path):
+    sections = diagram_converter.iter_sections(diagram_converter.read_diagram(path))
+    with open(os.devnull, 'w') as f:
+        return diagram_converter.write_sections(sections, f)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'shapes':>9} {'path':<10} {'time s':>8} {'peak MiB':>9} {'output KiB':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            path = os.path.join(tmp, f'diagram-{size}.csv')
+            generate_diagram(path, size, args.seed)
+            outputs = []
+            for name, convert in (('streaming', convert_streaming), ('dicts', convert_dicts),
+                                  ('pipeline', convert_pipeline)):
+                output, elapsed, peak = measure(convert, path)
+                outputs.append(output)
+                length = output if isinstance(output, int) else len(output)
+                print(f'{size:>9} {name:<10} {elapsed:>8.2f} {peak / 2**20:>9.1f} {length / 1024:>11.0f}')
+            if outputs[0] != outputs[1] or len(outputs[0]) != outputs[2]:
+                print(f'{size:>9} output differs between paths', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Show how /submit/lead behaves when the upstream is slow or failing.
+
+Starts the HTTPS stub with injected latency and errors on /taalk/submit,
+then replays submissions with a fake Lambda context and prints per-call
+latency, the transfer number returned and the breaker transitions.
+
+    python benchmarks/fault_injection.py --latency 3 --remaining-ms 2000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'blacklist_function'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import stub_upstream
+
+
+class FakeContext:
+    aws_request_id = 'fault-injection'
+
+    def __init__(self, remaining_ms):
+        self.deadline = time.monotonic() + remaining_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay /submit/lead against a faulty upstream')
+    parser.add_argument('--calls', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=3.0, help='Injected upstream latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--remaining-ms', type=int, default=2000, help='Simulated Lambda time left per call')
+    args = parser.parse_args()
+
+    server, host, cert = stub_upstream.start_stub(tls=True)
+    stub_upstream.FAULTS['/taalk/submit'] = {'latency': args.latency, 'error_rate': args.error_rate}
+    os.environ['ENDPOINT'] = host
+    os.environ['REQUESTS_CA_BUNDLE'] = cert
+    import lambda_function
+
+    event = {
+        'rawPath': '/submit/lead',
+        'body': json.dumps({'campaign_id': 1, 'phone': '5551234567'}),
+        'queryStringParameters': {'default_transfer_number': '+15550000000'}
+    }
+    for i in range(args.calls):
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler(event, FakeContext(args.remaining_ms))
+        elapsed = (time.perf_counter() - start) * 1000
+        state = lambda_function.get_breaker('/taalk/submit').state
+        print(f"call {i:>3}: {elapsed:8.1f} ms  breaker={state:<9} {response.get('transferNumber') or json.loads(response['body']).get('transferNumber')}")
+    print(json.dumps(lambda_function.breaker_metrics(), indent=2))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
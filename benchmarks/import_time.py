@@ -0,0 +1,61 @@
+"""
+Report what importing lambda_function costs on a cold interpreter.
+
+Runs ``python -X importtime`` in fresh subprocesses and prints the median
+total plus the slowest modules by cumulative time, like the cold start of a
+new Lambda container.
+
+    python benchmarks/import_time.py --runs 5 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'blacklist_function')
+
+
+def import_times(module):
+    """
+    Return {module name: (self us, cumulative us)} for one cold import.
+    """
+    code = f'import {module}' if module else 'pass'
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=FUNCTION_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold import-time breakdown for lambda_function')
+    parser.add_argument('--module', default='lambda_function')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    # Warm the bytecode cache so compilation isn't counted.
+    import_times(args.module)
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    totals = [run[args.module][1] for run in runs]
+    print(f"{args.module}: median {statistics.median(totals) / 1000:.2f} ms over {args.runs} runs")
+
+    # Leave out what the interpreter imports before our code runs.
+    startup = import_times(None)
+    last = {name: times for name, times in runs[-1].items() if name not in startup}
+    print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+    for name, (self_us, cumulative_us) in sorted(last.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f"{cumulative_us / 1000:>14.2f}{self_us / 1000:>10.2f}  {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Load test and latency benchmark for lambda_handler against the local stub.
+
+Replays a weighted mix of realistic events for every route through
+lambda_handler, first one at a time and then from a pool of concurrent
+callers. For each route it reports p50/p95/p99 latency, throughput and the
+peak memory allocated per call. Results are written as JSON so runs from
+different commits can be compared:
+
+    python benchmarks/load_test.py --profile realistic --output before.json
+    python benchmarks/load_test.py --profile realistic --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'blacklist_function'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import stub_upstream
+
+# route -> share of traffic
+DEFAULT_MIX = {
+    '/taalk/check/dnc': 0.4,
+    '/lead/lookup': 0.3,
+    '/submit/lead': 0.2,
+    '/taalk/dnc': 0.1,
+}
+
+
+class FakeContext:
+    aws_request_id = 'load-test'
+
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+
+def make_event(route, rng, callers):
+    # Callers repeat, like retries and multi-step call flows do.
+    phone = rng.choice(callers)
+    if route == '/lead/lookup':
+        return {'rawPath': route, 'queryStringParameters': {'pin': phone[-4:]}}
+    if route == '/submit/lead':
+        body = {
+            'campaign_id': 4,
+            'phone': phone,
+            'first_name': 'Jane',
+            'last_name': 'Doe',
+            'annual_income': rng.choice(['sixty thousand', '$85,000', '120k']),
+            'unsecured_debt': 'twenty five thousand',
+            'postcode': 'six two seven oh one',
+            'date_of_birth': '01/02/1980',
+        }
+        return {'rawPath': route, 'body': json.dumps(body), 'queryStringParameters': {}}
+    body = {'phone': phone, 'first_name': 'Jane', 'last_name': 'Doe', 'person_found': rng.random() < 0.5}
+    return {'rawPath': route, 'body': json.dumps(body)}
+
+
+def make_events(count, mix, seed, unique_callers):
+    rng = random.Random(seed)
+    callers = [str(rng.randint(2000000000, 9999999999)) for _ in range(unique_callers)]
+    routes = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    return [(route, make_event(route, rng, callers)) for route in routes]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(samples, elapsed):
+    return {
+        'calls': len(samples),
+        'p50_ms': round(percentile(samples, 50), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+    }
+
+
+def run(handler, events, concurrency):
+    """
+    Return ({route: [latency ms]}, wall seconds).
+    """
+    context = FakeContext()
+
+    def timed(item):
+        route, event = item
+        start = time.perf_counter()
+        handler(event, context)
+        return route, (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    if concurrency <= 1:
+        results = [timed(item) for item in events]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(timed, events))
+    elapsed = time.perf_counter() - start
+    latencies = {}
+    for route, ms in results:
+        latencies.setdefault(route, []).append(ms)
+    return latencies, elapsed
+
+
+def allocations(handler, events):
+    """
+    Mean peak bytes allocated per call for each route.
+    """
+    context = FakeContext()
+    peaks = {}
+    tracemalloc.start()
+    for route, event in events:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        handler(event, context)
+        peaks.setdefault(route, []).append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return {route: round(sum(values) / len(values)) for route, values in peaks.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(title, stats):
+    print(f"\n{title}")
+    print(f"{'route':<20}{'calls':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'rps':>9}{'alloc KiB':>11}")
+    for route, row in sorted(stats.items()):
+        alloc = row.get('alloc_bytes')
+        alloc = f"{alloc / 1024:.1f}" if alloc is not None else '-'
+        print(f"{route:<20}{row['calls']:>7}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+              f"{row['p99_ms']:>9.2f}{row['throughput_rps'] or 0:>9.1f}{alloc:>11}")
+
+
+def compare(current, baseline):
+    print("\np99 change against baseline")
+    for mode in ('sequential', 'concurrent'):
+        for route, row in sorted(current[mode].items()):
+            before = baseline.get(mode, {}).get(route)
+            if not before:
+                continue
+            change = (row['p99_ms'] - before['p99_ms']) / before['p99_ms'] * 100 if before['p99_ms'] else 0
+            print(f"{mode:<11}{route:<20}{before['p99_ms']:>9.2f} -> {row['p99_ms']:>9.2f} ms ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test lambda_handler against a local stub upstream')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--profile', choices=sorted(stub_upstream.PROFILES), default='fast')
+    parser.add_argument('--callers', type=int, default=200, help='Distinct phone numbers in the mix')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-cache', action='store_true', help='Disable the in-process result caches')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--compare', help='Baseline JSON from an earlier run')
+    args = parser.parse_args()
+
+    server, host, cert = stub_upstream.start_stub(tls=True)
+    stub_upstream.apply_profile(args.profile)
+    os.environ['ENDPOINT'] = host
+    os.environ['REQUESTS_CA_BUNDLE'] = cert
+    os.environ.setdefault('LOG_LEVEL', 'error')
+    if args.no_cache:
+        os.environ['CACHE_MAX_ENTRIES'] = '0'
+    import lambda_function
+    import metrics
+    metrics.set_sink(lambda document: None)
+
+    handler = lambda_function.lambda_handler
+    events = make_events(args.requests, DEFAULT_MIX, args.seed, args.callers)
+    # Warm the connection pool so the first call doesn't skew p99.
+    run(handler, events[:args.concurrency], args.concurrency)
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'config': vars(args),
+    }
+    for mode, concurrency in (('sequential', 1), ('concurrent', args.concurrency)):
+        lambda_function.dnc_cache.clear()
+        lambda_function.lookup_cache.clear()
+        latencies, elapsed = run(handler, events, concurrency)
+        results[mode] = {route: summarize(samples, elapsed) for route, samples in latencies.items()}
+        total = [ms for samples in latencies.values() for ms in samples]
+        results[mode]['all'] = summarize(total, elapsed)
+    for route, alloc in allocations(handler, events[:min(200, len(events))]).items():
+        results['sequential'][route]['alloc_bytes'] = alloc
+    server.shutdown()
+
+    print_table('sequential', results['sequential'])
+    print_table(f'concurrent ({args.concurrency} callers)', results['concurrent'])
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
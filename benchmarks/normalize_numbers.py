@@ -0,0 +1,197 @@
+"""
+Micro-benchmark and randomized corpus check for normalizer.py.
+
+The corpus is generated from a fixed seed: random digit strings and amounts
+are spoken the ways callers say them ("oh" for zero, "double five", filler
+words, punctuation) and must normalize back to the original value, and
+random alphanumeric PINs ("A1B2") must come back unchanged.
+
+    python benchmarks/normalize_numbers.py --cases 5000
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'blacklist_function'))
+
+from normalizer import DIGIT_WORDS, normalize_amount, normalize_digits, normalize_phone, normalize_pin
+
+FILLERS = ['', 'my number is', 'um', 'it is', 'uh']
+TEENS = ['ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen',
+         'sixteen', 'seventeen', 'eighteen', 'nineteen']
+TENS = ['', '', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety']
+
+
+def legacy_clean_up_pin(pin):
+    """
+    The replace-chain implementation the normalizer replaced, for comparison.
+    """
+    pin = pin.replace('(', '').replace(')', '').replace('-', '').replace(',', '')
+    number_map = {
+        'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4',
+        'five': '5', 'six': '6', 'seven': '7', 'eight': '8', 'nine': '9'
+    }
+    for word, digit in number_map.items():
+        pin = pin.replace(word, digit)
+    return pin.replace(' ', '')
+
+
+LEGACY_NUMBER_WORDS = {
+    'zero': 0, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11,
+    'twelve': 12, 'thirteen': 13, 'fourteen': 14, 'fifteen': 15,
+    'sixteen': 16, 'seventeen': 17, 'eighteen': 18, 'nineteen': 19,
+    'twenty': 20, 'thirty': 30, 'forty': 40, 'fifty': 50, 'sixty': 60,
+    'seventy': 70, 'eighty': 80, 'ninety': 90
+}
+LEGACY_SCALE_WORDS = {'thousand': 1000, 'million': 1000000, 'billion': 1000000000}
+
+
+def legacy_clean_up_money(money_number):
+    """
+    The words_to_number amount parser the normalizer replaced, for comparison.
+    """
+    money_number = money_number.replace('(', '').replace(')', '').replace('-', '')
+    text = money_number.lower().replace('-', ' ').replace(',', '').replace('$', '')
+    total = 0
+    current = 0
+    found = False
+    for word in text.split():
+        if word in LEGACY_NUMBER_WORDS:
+            current += LEGACY_NUMBER_WORDS[word]
+        elif word == 'hundred':
+            current = (current or 1) * 100
+        elif word in LEGACY_SCALE_WORDS:
+            total += (current or 1) * LEGACY_SCALE_WORDS[word]
+            current = 0
+        elif word.endswith('k') and word[:-1].replace('.', '', 1).isdigit():
+            current += float(word[:-1]) * 1000
+        elif word.replace('.', '', 1).isdigit():
+            current += float(word)
+        else:
+            continue
+        found = True
+    if not found:
+        return 0
+    return int(total + current)
+
+
+def speak_digits(rng, digits):
+    words = [rng.choice(FILLERS)]
+    i = 0
+    while i < len(digits):
+        digit = digits[i]
+        if i + 1 < len(digits) and digits[i + 1] == digit and rng.random() < 0.5:
+            words.append(f'double {DIGIT_WORDS[int(digit)]}')
+            i += 2
+            continue
+        if digit == '0' and rng.random() < 0.5:
+            words.append('oh')
+        elif rng.random() < 0.2:
+            words.append(digit)
+        else:
+            words.append(DIGIT_WORDS[int(digit)])
+        i += 1
+    return rng.choice([' ', ', ', ' - ']).join(w for w in words if w)
+
+
+def speak_below_thousand(n):
+    words = []
+    if n >= 100:
+        words += [DIGIT_WORDS[n // 100], 'hundred']
+        n %= 100
+    if n >= 20:
+        words.append(TENS[n // 10])
+        n %= 10
+        if n:
+            words.append(DIGIT_WORDS[n])
+    elif n >= 10:
+        words.append(TEENS[n - 10])
+    elif n:
+        words.append(DIGIT_WORDS[n])
+    return words
+
+
+def speak_amount(rng, amount):
+    if rng.random() < 0.2:
+        return f'${amount:,}'
+    words = []
+    for scale, name in ((1000000, 'million'), (1000, 'thousand'), (1, '')):
+        part = amount // scale % 1000
+        if part:
+            words += speak_below_thousand(part)
+            if name:
+                words.append(name)
+    if rng.random() < 0.3:
+        words.append('dollars')
+    return ' '.join(words) or 'zero'
+
+
+def alphanumeric_pin(rng):
+    """
+    A PIN of letters and digits with at least one of each, so a letter
+    touches a digit, e.g. "A1B2".
+    """
+    chars = [rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ'), rng.choice('0123456789')]
+    chars += [rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ0123456789') for _ in range(rng.randint(2, 6))]
+    rng.shuffle(chars)
+    return ''.join(chars)
+
+
+def check_corpus(cases, seed):
+    rng = random.Random(seed)
+    failures = []
+    for _ in range(cases):
+        digits = ''.join(rng.choice('0123456789') for _ in range(rng.randint(4, 10)))
+        spoken = speak_digits(rng, digits)
+        if normalize_digits(spoken).value != digits:
+            failures.append((spoken, digits, normalize_digits(spoken)))
+
+        phone = str(rng.randint(2000000000, 9999999999))
+        spoken = speak_digits(rng, rng.choice(['', '1']) + phone)
+        if normalize_phone(spoken).value != '+1' + phone:
+            failures.append((spoken, phone, normalize_phone(spoken)))
+
+        pin = alphanumeric_pin(rng)
+        if normalize_pin(pin).value != pin:
+            failures.append((pin, pin, normalize_pin(pin)))
+
+        amount = rng.randint(0, 999999999)
+        spoken = speak_amount(rng, amount)
+        if normalize_amount(spoken).value != amount:
+            failures.append((spoken, amount, normalize_amount(spoken)))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark and check the number normalizer')
+    parser.add_argument('--cases', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    failures = check_corpus(args.cases, args.seed)
+    print(f"corpus: {args.cases * 4} cases, {len(failures)} failures")
+    for spoken, expected, result in failures[:10]:
+        print(f"  {spoken!r}: expected {expected!r}, got {result!r}")
+
+    samples = {
+        'pin': 'one two three four five six',
+        'phone': '(555) 123-4567',
+        'spoken phone': 'five five five, one two three, four five six seven',
+        'amount': 'one hundred and twenty five thousand',
+    }
+    print(f"{'input':<14}{'legacy us':>12}{'engine us':>12}")
+    for name, text in samples.items():
+        legacy, engine = (legacy_clean_up_money, normalize_amount) if name == 'amount' else (
+            legacy_clean_up_pin, normalize_digits)
+        legacy_us = timeit.timeit(lambda: legacy(text), number=args.number) / args.number * 1e6
+        engine_us = timeit.timeit(lambda: engine(text), number=args.number) / args.number * 1e6
+        print(f"{name:<14}{legacy_us:>12.2f}{engine_us:>12.2f}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
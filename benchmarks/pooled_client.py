@@ -0,0 +1,65 @@
+"""
+Compare bare requests.get against the pooled upstream session.
+
+Runs both against a local HTTPS stub and prints p50/p99 latency per call.
+
+    python benchmarks/pooled_client.py --calls 500
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'blacklist_function'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from stub_upstream import start_stub
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(call, calls):
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pooled upstream client')
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    server, host, cert = start_stub(tls=True)
+    os.environ['ENDPOINT'] = host
+    # requests prefers the environment bundle over Session.verify.
+    os.environ['REQUESTS_CA_BUNDLE'] = cert
+    import requests
+    import lambda_function
+
+    url = f'https://{host}/lead/blacklisted'
+    params = {'phone': '+15551234567'}
+
+    results = {
+        'requests.get': measure(
+            lambda: requests.get(url, params=params), args.calls),
+        'pooled session': measure(
+            lambda: lambda_function.upstream_get('/lead/blacklisted', params), args.calls),
+    }
+    server.shutdown()
+
+    print(f"{'client':<16}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for name, samples in results.items():
+        print(f"{name:<16}{percentile(samples, 50):>10.2f}"
+              f"{percentile(samples, 99):>10.2f}{statistics.mean(samples):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
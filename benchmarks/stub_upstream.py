@@ -0,0 +1,140 @@
+"""
+Local stand-in for the inboundprospect API used by the benchmarks.
+
+Serves /lead/blacklisted, /lead/lookup, /taalk/submit and /taalk/dnc with
+canned JSON, over plain HTTP or HTTPS with a throwaway self-signed cert.
+"""
+import json
+import os
+import random
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+RESPONSES = {
+    '/lead/blacklisted': {'blacklisted': False},
+    '/lead/lookup': {
+        'data': [{
+            'first_name': 'Jane',
+            'last_name': 'Doe',
+            'phone_numbers': [{'number': '+15551234567'}],
+            'email_addresses': [{'email_address': 'jane@example.com'}],
+            'addresses': [{
+                'address': '1 Main St, Springfield, IL 62701',
+                'line1': '1 Main St',
+                'city': 'Springfield',
+                'state': 'IL',
+                'postcode': '62701'
+            }]
+        }]
+    },
+    '/taalk/submit': {
+        'success': True,
+        'message': 'ok',
+        'buyer': {'name': 'Stub Buyer', 'transfer_number': '5550001111'}
+    },
+    '/taalk/dnc': {'success': True},
+}
+
+# Fault injection per path, e.g.
+#   FAULTS['/taalk/submit'] = {'latency': 2.0, 'error_rate': 0.5, 'status': 503}
+# latency and jitter (a uniform random extra) are in seconds; error_rate is
+# the share of requests answered with `status` (default 500) instead of the
+# canned response; padding adds that many bytes to the response body.
+FAULTS = {}
+
+# Named latency, error and payload-size profiles applied to every path.
+PROFILES = {
+    'fast': {},
+    'realistic': {'latency': 0.04, 'jitter': 0.03},
+    'slow': {'latency': 0.4, 'jitter': 0.4},
+    'flaky': {'latency': 0.04, 'jitter': 0.03, 'error_rate': 0.1, 'status': 503},
+    'large': {'latency': 0.04, 'jitter': 0.03, 'padding': 64 * 1024},
+}
+
+
+def apply_profile(name):
+    FAULTS.clear()
+    for path in RESPONSES:
+        FAULTS[path] = dict(PROFILES[name])
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        path = urlparse(self.path).path
+        payload = RESPONSES.get(path)
+        status = 200 if payload is not None else 404
+        fault = FAULTS.get(path, {})
+        delay = fault.get('latency', 0) + random.uniform(0, fault.get('jitter', 0))
+        if delay:
+            time.sleep(delay)
+        if random.random() < fault.get('error_rate', 0):
+            status, payload = fault.get('status', 500), {'error': 'Injected fault'}
+        elif fault.get('padding') and payload is not None:
+            payload = dict(payload, padding='x' * fault['padding'])
+        body = json.dumps(payload if payload is not None else {'error': 'Not found'}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 makes concurrent load tests hit SYN retries.
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients giving up on an injected delay are expected, not errors.
+        pass
+
+
+def make_self_signed_cert(directory):
+    """
+    Create a localhost cert/key pair with openssl and return their paths.
+    """
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+        '-keyout', key, '-out', cert, '-days', '1',
+        '-subj', '/CN=localhost',
+        '-addext', 'subjectAltName=DNS:localhost',
+    ], check=True, capture_output=True)
+    return cert, key
+
+
+def start_stub(tls=False, handler=StubHandler):
+    """
+    Start the stub on a free localhost port in a daemon thread.
+
+    Returns (server, host_port, cert_path). cert_path is None without TLS and
+    can be passed as ``verify=`` to requests otherwise.
+    """
+    server = StubServer(('localhost', 0), handler)
+    cert = None
+    if tls:
+        cert, key = make_self_signed_cert(tempfile.mkdtemp())
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'localhost:{server.server_address[1]}', cert
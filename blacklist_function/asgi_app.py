@@ -0,0 +1,61 @@
+'''
+ASGI entry point for running the blacklist function as a container service:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 8080
+
+Requests are turned into Lambda function URL style events and go through the
+same async core as the Lambda, so routes and responses are identical.
+'''
+import json
+from urllib.parse import parse_qsl
+
+from lambda_function import lambda_handler_async, warm_up
+
+
+def to_event(scope, body):
+    headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in scope.get('headers', [])}
+    return {
+        'rawPath': scope['path'],
+        'body': body.decode() if body else None,
+        'queryStringParameters': dict(parse_qsl(scope.get('query_string', b'').decode())),
+        'headers': headers,
+        'requestContext': {'http': {'method': scope['method']}}
+    }
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Ready the connection pool and caches before taking traffic.
+                import asyncio
+                await asyncio.get_running_loop().run_in_executor(None, warm_up)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    event = to_event(scope, await read_body(receive))
+    response = await lambda_handler_async(event, None)
+    body = response.get('body') or ''
+    if not isinstance(body, str):
+        body = json.dumps(body)
+    body = body.encode()
+    await send({
+        'type': 'http.response.start',
+        'status': response.get('statusCode', 200),
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode())
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
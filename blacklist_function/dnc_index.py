@@ -0,0 +1,220 @@
+'''
+Local snapshot of blacklisted phone numbers for answering DNC checks
+without a call to /lead/blacklisted.
+
+A snapshot file is a Bloom filter followed by a sorted array of 64-bit phone
+numbers. It is memory-mapped, so loading it costs no parsing time and pages
+are shared between warm invocations. Numbers added or removed since the
+snapshot was built come from a delta file with one "+number" or "-number"
+per line, which is re-read incrementally as it grows.
+
+Build a snapshot from a CSV of numbers with:
+
+    python dnc_index.py numbers.csv dnc.idx --column phone
+'''
+import bisect
+import math
+import mmap
+import os
+import struct
+import time
+
+from normalizer import phone_key
+
+MAGIC = b'DNCIDX1\0'
+# count, bloom bits, hash count, reserved, created (unix time)
+HEADER = struct.Struct('<QQIId')
+HEADER_SIZE = len(MAGIC) + HEADER.size
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+def phone_to_int(phone):
+    '''
+    The ten digits of normalizer.phone_key() as an integer, or None if the
+    phone doesn't normalize to ten digits.
+    '''
+    key = phone_key(phone)
+    return None if key is None else int(key[2:])
+
+def _mix(value):
+    '''
+    splitmix64 finalizer, used to derive the Bloom filter probe positions.
+    '''
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+def _probes(number, bits, hashes):
+    h1 = _mix(number)
+    h2 = _mix(h1) | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+def _align8(size):
+    return (size + 7) & ~7
+
+
+class DncIndex:
+    '''
+    Read-only view over a snapshot file plus in-memory delta updates.
+
+    Numbers added locally for requests that haven't reached the upstream
+    yet (a spooled DNC write) are kept in `pending` until confirm() is
+    called for them. Unlike delta updates they survive a rotation of the
+    delta feed, which may not carry them yet.
+    '''
+    def __init__(self, path, delta_path=None, max_age=None):
+        self.path = path
+        self.delta_path = delta_path
+        self.max_age = max_age
+        self.added = set()
+        self.removed = set()
+        self.pending = set()
+        self._delta_offset = 0
+        self._delta_mtime = 0
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a DNC index snapshot')
+        self.count, self.bits, self.hashes, _, self.created = HEADER.unpack_from(self._mmap, len(MAGIC))
+        bloom_size = _align8((self.bits + 7) // 8)
+        view = memoryview(self._mmap)
+        self._bloom = view[HEADER_SIZE:HEADER_SIZE + bloom_size]
+        numbers_start = HEADER_SIZE + bloom_size
+        self._numbers = view[numbers_start:numbers_start + 8 * self.count].cast('Q')
+        self.refreshed = self.created
+        if delta_path:
+            self.refresh()
+
+    def refresh(self):
+        '''
+        Apply lines appended to the delta file since the last refresh.
+        '''
+        try:
+            stat = os.stat(self.delta_path)
+        except FileNotFoundError:
+            return
+        if stat.st_size < self._delta_offset:
+            # The feed was rotated, so start over from its first line.
+            self.added.clear()
+            self.removed.clear()
+            self._delta_offset = 0
+        if stat.st_size == self._delta_offset and stat.st_mtime == self._delta_mtime:
+            return
+        with open(self.delta_path, 'rb') as f:
+            f.seek(self._delta_offset)
+            chunk = f.read()
+        # Leave a partially written last line for the next refresh.
+        end = chunk.rfind(b'\n') + 1
+        for line in chunk[:end].decode().splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            number = phone_to_int(line.lstrip('+-'))
+            if number is None:
+                continue
+            if line.startswith('-'):
+                self.remove(number)
+            else:
+                self.add(number)
+        self._delta_offset += end
+        self._delta_mtime = stat.st_mtime
+        self.refreshed = max(self.refreshed, stat.st_mtime)
+
+    def add(self, number, pending=False):
+        self.removed.discard(number)
+        (self.pending if pending else self.added).add(number)
+
+    def confirm(self, number, accepted=True):
+        '''
+        Settle a pending addition once its request was delivered: it stays
+        added if the upstream accepted it and is dropped otherwise.
+        '''
+        if number in self.pending:
+            self.pending.discard(number)
+            if accepted:
+                self.added.add(number)
+
+    def remove(self, number):
+        self.added.discard(number)
+        self.removed.add(number)
+
+    def is_stale(self):
+        return bool(self.max_age) and time.time() - self.refreshed > self.max_age
+
+    def _in_snapshot(self, number):
+        bloom = self._bloom
+        for bit in _probes(number, self.bits, self.hashes):
+            if not bloom[bit >> 3] & (1 << (bit & 7)):
+                return False
+        position = bisect.bisect_left(self._numbers, number)
+        return position < self.count and self._numbers[position] == number
+
+    def lookup(self, phone):
+        '''
+        Return True/False if the index can answer for this phone, or None
+        when the number can't be parsed or the snapshot is stale and the
+        caller should ask the API.
+        '''
+        number = phone_to_int(phone)
+        if number is None or self.is_stale():
+            return None
+        if number in self.pending or number in self.added:
+            return True
+        if number in self.removed:
+            return False
+        return self._in_snapshot(number)
+
+
+def build_index(numbers, output_file, fp_rate=0.001):
+    '''
+    Write a snapshot for an iterable of phone numbers. Returns the number
+    of distinct numbers written.
+    '''
+    values = sorted({n for n in (phone_to_int(p) for p in numbers) if n is not None})
+    count = len(values)
+    bits = max(64, int(-max(count, 1) * math.log(fp_rate) / (math.log(2) ** 2)))
+    hashes = max(1, round(bits / max(count, 1) * math.log(2)))
+    bloom = bytearray(_align8((bits + 7) // 8))
+    for number in values:
+        for bit in _probes(number, bits, hashes):
+            bloom[bit >> 3] |= 1 << (bit & 7)
+    tmp_file = output_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(count, bits, hashes, 0, time.time()))
+        f.write(bloom)
+        f.write(struct.pack(f'<{count}Q', *values))
+    os.replace(tmp_file, output_file)
+    return count
+
+def read_numbers_csv(filename, column=None):
+    '''
+    Yield phone numbers from a CSV, either from a named column or the first one.
+    '''
+    import csv
+
+    with open(filename, newline='') as f:
+        if column:
+            for row in csv.DictReader(f):
+                yield row[column]
+        else:
+            for row in csv.reader(f):
+                if row:
+                    yield row[0]
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build a DNC index snapshot from a CSV of phone numbers')
+    parser.add_argument('input', help='CSV file with one phone number per row')
+    parser.add_argument('output', help='Snapshot file to write')
+    parser.add_argument('--column', help='CSV column holding the phone number (default: first column, no header)')
+    parser.add_argument('--fp-rate', type=float, default=0.001, help='Bloom filter false positive rate')
+    args = parser.parse_args()
+
+    count = build_index(read_numbers_csv(args.input, args.column), args.output, args.fp_rate)
+    print(f"Wrote {count} numbers to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+'''
+Write-behind spool for DNC requests.
+
+When /taalk/dnc can't be called right away, requests are appended to a
+spool and drain() delivers them later in batches. Records for the same
+phone number are merged, failed deliveries are retried on the next drain
+and records that keep failing go to a dead letter file.
+
+Spool is the interface: append(record), take() returning the records to
+deliver, put_back(records), dead_letter(records), done() and len(). take()
+hands out the records taken last time again until done() is called, so a
+crash during a drain delivers them twice rather than losing them.
+open_spool() creates one from a spec string:
+
+    sqs:<queue url>,<dead letter queue url>   SqsSpool, durable
+    file:<path>                               FileSpool, for local testing
+    memory                                    MemorySpool, for tests
+'''
+import json
+import os
+import threading
+import time
+
+from normalizer import phone_key
+
+
+class Spool:
+    '''
+    Interface of a DNC spool; see the module docstring for the contract.
+    '''
+    def append(self, record):
+        raise NotImplementedError
+
+    def take(self):
+        raise NotImplementedError
+
+    def put_back(self, records):
+        raise NotImplementedError
+
+    def dead_letter(self, records):
+        raise NotImplementedError
+
+    def done(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemorySpool(Spool):
+    '''
+    In-process lists; records are lost with the process.
+    '''
+    def __init__(self):
+        self.records = []
+        self.taken = None
+        self.dead = []
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def take(self):
+        with self._lock:
+            if self.taken is None:
+                self.taken, self.records = self.records, []
+            return list(self.taken)
+
+    def put_back(self, records):
+        with self._lock:
+            self.records.extend(records)
+
+    def dead_letter(self, records):
+        with self._lock:
+            self.dead.extend(records)
+
+    def done(self):
+        with self._lock:
+            self.taken = None
+
+    def __len__(self):
+        return len(self.records) + len(self.taken or ())
+
+
+class FileSpool(Spool):
+    '''
+    JSON lines file. take() moves the file aside so new requests can be
+    appended while a drain runs. On Lambda the file only lives as long as
+    the container, so this is for local runs and tests.
+    '''
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.draining_path = path + '.draining'
+        self.dead_letter_path = path + '.dead'
+        self.fsync = fsync
+        self._lock = threading.Lock()
+
+    def _append(self, path, records):
+        with open(path, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':')) + '\n')
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def append(self, record):
+        with self._lock:
+            self._append(self.path, [record])
+
+    def take(self):
+        with self._lock:
+            if not os.path.exists(self.draining_path):
+                try:
+                    os.replace(self.path, self.draining_path)
+                except FileNotFoundError:
+                    return []
+            records = []
+            with open(self.draining_path) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # A line cut short by a crash while appending.
+                        continue
+            return records
+
+    def put_back(self, records):
+        if records:
+            with self._lock:
+                self._append(self.path, records)
+
+    def dead_letter(self, records):
+        if records:
+            with self._lock:
+                self._append(self.dead_letter_path, records)
+
+    def done(self):
+        with self._lock:
+            try:
+                os.remove(self.draining_path)
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        count = 0
+        for path in (self.path, self.draining_path):
+            try:
+                with open(path) as f:
+                    count += sum(1 for _ in f)
+            except FileNotFoundError:
+                pass
+        return count
+
+
+class SqsSpool(Spool):
+    '''
+    Amazon SQS queue, one message per record. Messages handed out by take()
+    stay in the queue, invisible to other consumers, until done() deletes
+    them; if the drain dies first they become visible again after the
+    queue's visibility timeout. Records that keep failing are sent to the
+    dead letter queue.
+    '''
+    # SQS batch calls take at most 10 entries.
+    BATCH = 10
+
+    def __init__(self, queue_url, dead_letter_url, client=None, max_records=500):
+        if client is None:
+            import boto3
+            client = boto3.client('sqs')
+        self.queue_url = queue_url
+        self.dead_letter_url = dead_letter_url
+        self.client = client
+        self.max_records = max_records
+        self._taken = None
+        self._lock = threading.Lock()
+
+    def _send(self, queue_url, records):
+        for start in range(0, len(records), self.BATCH):
+            self.client.send_message_batch(QueueUrl=queue_url, Entries=[
+                {'Id': str(index), 'MessageBody': json.dumps(record, separators=(',', ':'))}
+                for index, record in enumerate(records[start:start + self.BATCH])
+            ])
+
+    def append(self, record):
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(record, separators=(',', ':')))
+
+    def take(self):
+        with self._lock:
+            if self._taken is None:
+                self._taken = []
+                while len(self._taken) < self.max_records:
+                    messages = self.client.receive_message(
+                        QueueUrl=self.queue_url, MaxNumberOfMessages=self.BATCH, WaitTimeSeconds=0
+                    ).get('Messages', [])
+                    if not messages:
+                        break
+                    for message in messages:
+                        try:
+                            record = json.loads(message['Body'])
+                        except ValueError:
+                            record = None
+                        self._taken.append((message['ReceiptHandle'], record))
+            return [record for _, record in self._taken if record is not None]
+
+    def put_back(self, records):
+        if records:
+            self._send(self.queue_url, records)
+
+    def dead_letter(self, records):
+        if records:
+            self._send(self.dead_letter_url, records)
+
+    def done(self):
+        with self._lock:
+            taken, self._taken = self._taken or [], None
+        for start in range(0, len(taken), self.BATCH):
+            self.client.delete_message_batch(QueueUrl=self.queue_url, Entries=[
+                {'Id': str(index), 'ReceiptHandle': receipt}
+                for index, (receipt, _) in enumerate(taken[start:start + self.BATCH])
+            ])
+
+    def __len__(self):
+        attributes = self.client.get_queue_attributes(
+            QueueUrl=self.queue_url,
+            AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+        )['Attributes']
+        return sum(int(value) for value in attributes.values())
+
+
+def open_spool(spec):
+    '''
+    Create a spool from a spec string: "sqs:<queue url>,<dead letter queue
+    url>", "file:<path>" or "memory".
+    '''
+    if spec.startswith('sqs:'):
+        queue_url, _, dead_letter_url = spec[len('sqs:'):].partition(',')
+        if not dead_letter_url:
+            raise ValueError('An SQS spool needs a dead letter queue: sqs:<queue url>,<dead letter queue url>')
+        return SqsSpool(queue_url, dead_letter_url)
+    if spec.startswith('file:'):
+        return FileSpool(spec[len('file:'):])
+    if spec == 'memory':
+        return MemorySpool()
+    raise ValueError(f'Unknown DNC spool: {spec}')
+
+def new_record(body):
+    return dict(body, attempts=0, queued_at=time.time())
+
+def dedupe_by_phone(records):
+    '''
+    Keep the latest record per phone number, with the most attempts made
+    for that number so retries are not reset by a duplicate request.
+    Records whose phone isn't a full number are never merged.
+    '''
+    latest = {}
+    for position, record in enumerate(records):
+        key = phone_key(record.get('phone'))
+        if key is None:
+            latest[position] = record
+            continue
+        previous = latest.pop(key, None)
+        if previous is not None:
+            record = dict(record, attempts=max(record.get('attempts', 0), previous.get('attempts', 0)))
+        latest[key] = record
+    return list(latest.values())
+
+def drain(spool, send, batch_size=25, max_attempts=20, map_batch=map):
+    '''
+    Deliver everything in the spool once. `send(record)` returns normally
+    when the record was delivered and raises otherwise. `map_batch` runs
+    send over one batch, e.g. an executor's map to send it concurrently.
+    Returns counts of sent, retried and dead lettered records.
+    '''
+    records = dedupe_by_phone(spool.take())
+    stats = {'sent': 0, 'retry': 0, 'dead': 0}
+    if not records:
+        spool.done()
+        return stats
+    failed = []
+
+    def attempt(record):
+        try:
+            send(record)
+            return None
+        except Exception as e:
+            return dict(record, attempts=record.get('attempts', 0) + 1, error=str(e))
+
+    for start in range(0, len(records), batch_size):
+        for result in map_batch(attempt, records[start:start + batch_size]):
+            if result is None:
+                stats['sent'] += 1
+            else:
+                failed.append(result)
+    retry = [r for r in failed if r['attempts'] < max_attempts]
+    dead = [r for r in failed if r['attempts'] >= max_attempts]
+    spool.put_back(retry)
+    spool.dead_letter(dead)
+    spool.done()
+    stats['retry'] = len(retry)
+    stats['dead'] = len(dead)
+    return stats
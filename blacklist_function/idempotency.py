@@ -0,0 +1,157 @@
+'''
+Idempotency keys and request coalescing.
+
+A request's key comes from an Idempotency-Key header or from a hash of its
+normalized body. While a request with a key is in flight, identical ones
+wait for it and share its response instead of calling the upstream again.
+Completed responses are kept in a store for a TTL so that retries get them
+back immediately.
+
+A store has get(key) returning the stored response or None, and
+set(key, response, ttl). MemoryStore is per container; SqliteStore keeps
+responses in a local file, e.g. for tests or a container with a volume.
+'''
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def body_key(body):
+    '''
+    Hash of a JSON body that doesn't depend on key order or whitespace.
+    '''
+    text = json.dumps(body, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def header_key(headers, name):
+    '''
+    Value of the `name` header in any case, or None.
+    '''
+    name = name.lower()
+    for key, value in (headers or {}).items():
+        if key.lower() == name and value:
+            return value
+    return None
+
+
+class MemoryStore:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._data[key]
+                return None
+            return entry[1]
+
+    def set(self, key, response, ttl):
+        with self._lock:
+            self._data[key] = (time.time() + ttl, response)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class SqliteStore:
+    def __init__(self, path):
+        import sqlite3
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses '
+            '(key TEXT PRIMARY KEY, expires REAL NOT NULL, response TEXT NOT NULL)'
+        )
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT response FROM responses WHERE key = ? AND expires >= ?',
+                (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, response, ttl):
+        now = time.time()
+        with self._lock:
+            self._db.execute('DELETE FROM responses WHERE expires < ?', (now,))
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses (key, expires, response) VALUES (?, ?, ?)',
+                (key, now + ttl, json.dumps(response))
+            )
+
+
+def open_store(spec):
+    '''
+    Create a store from a spec string: "memory" or "sqlite:<path>".
+    '''
+    if spec.startswith('sqlite:'):
+        return SqliteStore(spec[len('sqlite:'):])
+    if spec in ('', 'memory'):
+        return MemoryStore()
+    raise ValueError(f'Unknown idempotency store: {spec}')
+
+
+class _InFlight:
+    __slots__ = ('done', 'response', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class Coalescer:
+    '''
+    Runs at most one call per key at a time and remembers completed
+    responses in `store` for `ttl` seconds.
+    '''
+    def __init__(self, store, ttl):
+        self.store = store
+        self.ttl = ttl
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, call, cacheable, timeout=None):
+        '''
+        Return (response, source) where source is "stored", "coalesced" or
+        "called". `cacheable(response)` decides whether a response is kept.
+        An error raised by `call` is raised in every waiting caller and
+        nothing is stored, so a retry calls again. Raises TimeoutError when
+        waiting on an in-flight call takes longer than `timeout` seconds.
+        '''
+        response = self.store.get(key)
+        if response is not None:
+            return response, 'stored'
+        with self._lock:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _InFlight()
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise TimeoutError('Timed out waiting for an identical request in flight')
+            if flight.error is not None:
+                raise flight.error
+            return flight.response, 'coalesced'
+        try:
+            flight.response = call()
+            if cacheable(flight.response):
+                self.store.set(key, flight.response, self.ttl)
+            return flight.response, 'called'
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            flight.done.set()
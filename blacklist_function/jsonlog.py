@@ -0,0 +1,174 @@
+'''
+Structured, sampled JSON logging for the request hot path.
+
+Each line is one JSON object with the level, message, request id and route.
+Below-warning lines are sampled per route (LOG_SAMPLE_RATES), and field
+values may be callables that are only evaluated when the line is written,
+so a dropped line costs a level check and nothing else. Phone, email and
+PIN fields are masked wherever they appear in the fields.
+
+The request id and route live in a context variable, like the metrics
+scope, so concurrent requests on the ASGI server keep their own. Threads
+don't inherit it: functions handed to another thread are wrapped with
+bind().
+
+    LOG_LEVEL=info
+    LOG_SAMPLE_RATES=/taalk/check/dnc=0.1,/lead/lookup=0.5
+'''
+import contextvars
+import json
+import os
+import random
+import sys
+from contextlib import contextmanager
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning', ERROR: 'error'}
+LEVEL = {name: level for level, name in LEVEL_NAMES.items()}.get(
+    os.getenv('LOG_LEVEL', 'info').lower(), INFO)
+
+
+def _parse_rates(value):
+    rates = {}
+    for item in value.split(','):
+        if '=' in item:
+            route, rate = item.rsplit('=', 1)
+            rates[route.strip()] = float(rate)
+    return rates
+
+SAMPLE_RATES = _parse_rates(os.getenv('LOG_SAMPLE_RATES', ''))
+DEFAULT_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1'))
+
+REDACTED_FIELDS = frozenset((
+    'phone', 'phone_number', 'phone_numbers', 'number', 'transfer_number',
+    'transferNumber', 'email', 'email_address', 'email_addresses', 'pin'
+))
+
+class _Request:
+    __slots__ = ('request_id', 'route', 'sampled')
+
+    def __init__(self, request_id, route, sampled):
+        self.request_id = request_id
+        self.route = route
+        self.sampled = sampled
+
+
+_current = contextvars.ContextVar('log_request', default=None)
+
+
+def _sample(route):
+    return random.random() < SAMPLE_RATES.get(route, DEFAULT_SAMPLE_RATE)
+
+@contextmanager
+def scope(request_id, route):
+    '''
+    Bind the request id and route to log lines written in the block, in
+    this context and in functions wrapped with bind(), and decide once
+    whether the request's info/debug lines are sampled in.
+    '''
+    token = _current.set(_Request(request_id, route, _sample(route)))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+def start_request(request_id, route):
+    '''
+    Bind the request id and route to log lines written in this context from
+    now on. Within a request that is already bound, e.g. a sub-call of
+    /taalk/multi or a batch record, the request id and sampling decision
+    are kept and only the route changes.
+    '''
+    current = _current.get()
+    if current is not None and request_id in (None, current.request_id):
+        _current.set(_Request(current.request_id, route, current.sampled))
+    else:
+        _current.set(_Request(request_id, route, _sample(route)))
+
+def bind(function):
+    '''
+    Wrap `function` so its log lines carry the current request when it
+    runs on another thread, e.g. an executor's.
+    '''
+    current = _current.get()
+    if current is None:
+        return function
+
+    def bound(*args, **kwargs):
+        token = _current.set(current)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return bound
+
+def request_id():
+    current = _current.get()
+    return None if current is None else current.request_id
+
+def _mask(value):
+    if isinstance(value, dict):
+        return {k: _mask(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_mask(v) for v in value]
+    text = str(value)
+    if '@' in text:
+        return '***@' + text.split('@', 1)[1]
+    return '***' + text[-2:] if len(text) > 4 else '***'
+
+def redact(value):
+    '''
+    Return a copy of `value` with sensitive fields masked, at any depth.
+    '''
+    if isinstance(value, dict):
+        return {
+            k: _mask(v) if k in REDACTED_FIELDS and v not in (None, '') else redact(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+def enabled(level):
+    if level < LEVEL:
+        return False
+    if level >= WARNING:
+        return True
+    current = _current.get()
+    return current is None or current.sampled
+
+def log(level, message, **fields):
+    if not enabled(level):
+        return
+    current = _current.get()
+    record = {
+        'level': LEVEL_NAMES[level],
+        'message': message,
+        'request_id': None if current is None else current.request_id,
+        'route': None if current is None else current.route,
+    }
+    for key, value in fields.items():
+        record[key] = value() if callable(value) else value
+    sys.stdout.write(json.dumps(redact(record), default=str) + '\n')
+
+def debug(message, **fields):
+    log(DEBUG, message, **fields)
+
+def info(message, **fields):
+    log(INFO, message, **fields)
+
+def warning(message, **fields):
+    log(WARNING, message, **fields)
+
+def error(message, **fields):
+    log(ERROR, message, **fields)
+
+def exception(message, **fields):
+    '''
+    Log an error with the traceback of the exception being handled.
+    '''
+    if not enabled(ERROR):
+        return
+    import traceback
+
+    log(ERROR, message, traceback=traceback.format_exc(), **fields)
@@ -1,178 +1,701 @@
 import json
-import requests
 import os
-from word2number import w2n
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from normalizer import normalize_phone, normalize_pin, phone_key, phone_words
+import jsonlog as log
+from lead import parse_lead
+import metrics
+from resilience import (
+    CircuitBreaker, CircuitOpenError, deadline_timeout, hedged_call, remaining_seconds
+)
+from router import ANY, HttpError, Router, is_async
+# requests, orjson, asyncio, concurrent.futures, datetime, dnc_index,
+# dnc_spool and idempotency are imported on first use so that a cold start only pays for
+# what the route it serves needs.
 ENDPOINT = os.getenv('ENDPOINT', 'staging.api.inboundprospect.com') # 'api.inboundprospect.com'
 
+# Upstream connection pool settings. The session below is created once per
+# container and reused by every warm invocation, so only the first call pays
+# for DNS, TCP and TLS setup.
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+HTTP_KEEP_ALIVE = os.getenv('HTTP_KEEP_ALIVE', 'true').lower() != 'false'
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '2'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+
+# (connect, read) timeouts per upstream route, in seconds.
+ROUTE_TIMEOUTS = {
+    '/lead/blacklisted': (HTTP_CONNECT_TIMEOUT, float(os.getenv('BLACKLISTED_READ_TIMEOUT', '3'))),
+    '/lead/lookup': (HTTP_CONNECT_TIMEOUT, float(os.getenv('LOOKUP_READ_TIMEOUT', '3'))),
+    '/taalk/submit': (HTTP_CONNECT_TIMEOUT, float(os.getenv('SUBMIT_READ_TIMEOUT', str(HTTP_READ_TIMEOUT)))),
+    '/taalk/dnc': (HTTP_CONNECT_TIMEOUT, float(os.getenv('DNC_READ_TIMEOUT', '5'))),
+}
+
+# Time kept back from the Lambda deadline to build a fallback response.
+DEADLINE_MARGIN = float(os.getenv('DEADLINE_MARGIN', '0.5'))
+
+# Circuit breaker per upstream route. Once the error rate over
+# BREAKER_WINDOW seconds reaches BREAKER_ERROR_RATE, calls fail fast with
+# CircuitOpenError for BREAKER_RESET_TIMEOUT seconds.
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', '0.5'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '5'))
+BREAKER_WINDOW = float(os.getenv('BREAKER_WINDOW', '30'))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '15'))
+
+# Idempotent routes get a second, hedged request when the first hasn't
+# answered within HEDGE_AFTER_MS. 0 turns hedging off.
+HEDGE_AFTER_MS = float(os.getenv('HEDGE_AFTER_MS', '0'))
+HEDGED_ROUTES = ('/lead/blacklisted', '/lead/lookup')
+
+_session = None
+
+
+def get_session():
+    '''
+    Return the pooled upstream session, creating it on first use.
+    '''
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=HTTP_POOL_SIZE,
+            max_retries=0
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['Connection'] = 'keep-alive' if HTTP_KEEP_ALIVE else 'close'
+        _session = session
+    return _session
+
+# Result caches for /lead/blacklisted and /lead/lookup, kept at module scope
+# so warm containers reuse them. TTLs are in seconds; "negative" means the
+# number is not blacklisted or the PIN has no record.
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '2048'))
+DNC_CACHE_TTL = float(os.getenv('DNC_CACHE_TTL', '3600'))
+DNC_CACHE_NEGATIVE_TTL = float(os.getenv('DNC_CACHE_NEGATIVE_TTL', '300'))
+LOOKUP_CACHE_TTL = float(os.getenv('LOOKUP_CACHE_TTL', '600'))
+LOOKUP_CACHE_NEGATIVE_TTL = float(os.getenv('LOOKUP_CACHE_NEGATIVE_TTL', '60'))
+
+MISSING = object()
+
+
+class TTLCache:
+    '''
+    Bounded LRU cache with separate TTLs for positive and negative results.
+    '''
+    def __init__(self, maxsize, ttl, negative_ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Return the cached value, or MISSING if absent or expired.
+        '''
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, negative=False):
+        ttl = self.negative_ttl if negative else self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data)
+        }
+
+
+dnc_cache = TTLCache(CACHE_MAX_ENTRIES, DNC_CACHE_TTL, DNC_CACHE_NEGATIVE_TTL)
+lookup_cache = TTLCache(CACHE_MAX_ENTRIES, LOOKUP_CACHE_TTL, LOOKUP_CACHE_NEGATIVE_TTL)
+
+
+# Optional local DNC index (see dnc_index.py). When DNC_INDEX_PATH points at a
+# snapshot, for example one shipped in a layer under /opt, check_dnc_handler
+# answers from it and only calls /lead/blacklisted when the index can't.
+DNC_INDEX_PATH = os.getenv('DNC_INDEX_PATH', '')
+DNC_DELTA_PATH = os.getenv('DNC_DELTA_PATH', '')
+DNC_INDEX_MAX_AGE = float(os.getenv('DNC_INDEX_MAX_AGE', '86400'))
+DNC_DELTA_REFRESH = float(os.getenv('DNC_DELTA_REFRESH', '60'))
+
+_dnc_index = None
+_dnc_index_checked = 0
+
+
+def get_dnc_index():
+    '''
+    Return the local DNC index, or None if it isn't configured or can't be loaded.
+    The delta feed is re-read at most every DNC_DELTA_REFRESH seconds.
+    '''
+    global _dnc_index, _dnc_index_checked
+    if not DNC_INDEX_PATH:
+        return None
+    now = time.monotonic()
+    if _dnc_index is None:
+        if _dnc_index_checked and now - _dnc_index_checked < DNC_DELTA_REFRESH:
+            return None
+        _dnc_index_checked = now
+        try:
+            from dnc_index import DncIndex
+            _dnc_index = DncIndex(DNC_INDEX_PATH, DNC_DELTA_PATH or None, DNC_INDEX_MAX_AGE)
+        except (OSError, ValueError) as e:
+            log.error('Error loading DNC index', path=DNC_INDEX_PATH, error=str(e))
+        return _dnc_index
+    if DNC_DELTA_PATH and now - _dnc_index_checked >= DNC_DELTA_REFRESH:
+        _dnc_index_checked = now
+        try:
+            _dnc_index.refresh()
+        except OSError as e:
+            log.error('Error refreshing DNC index delta', path=DNC_DELTA_PATH, error=str(e))
+    return _dnc_index
+
+def upstream_url(route):
+    return f'https://{ENDPOINT}{route}'
+
+breakers = {}
+
+
+def on_breaker_transition(name, previous, state):
+    metrics.count(f'BreakerTransition:{state}')
+    log.warning('Circuit breaker state change', upstream=name, previous=previous, state=state)
+
+def get_breaker(route):
+    breaker = breakers.get(route)
+    if breaker is None:
+        breaker = breakers.setdefault(route, CircuitBreaker(
+            route,
+            error_rate=BREAKER_ERROR_RATE,
+            min_calls=BREAKER_MIN_CALLS,
+            window=BREAKER_WINDOW,
+            reset_timeout=BREAKER_RESET_TIMEOUT
+        ))
+        breaker.listeners.append(on_breaker_transition)
+    return breaker
+
+def breaker_metrics():
+    return {route: breaker.metrics() for route, breaker in breakers.items()}
+
+def call_upstream(route, call, context=None):
+    '''
+    Make an upstream call under the route's breaker and deadline. `call`
+    takes the (connect, read) timeout and returns the response. Raises
+    CircuitOpenError without calling when the breaker is open.
+    '''
+    breaker = get_breaker(route)
+    try:
+        breaker.before_call()
+    except CircuitOpenError:
+        metrics.count('BreakerRejected')
+        raise
+    timeout = deadline_timeout(
+        ROUTE_TIMEOUTS.get(route, (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)),
+        remaining_seconds(context, DEADLINE_MARGIN)
+    )
+    try:
+        with metrics.timer(f'Upstream:{route}'):
+            if HEDGE_AFTER_MS > 0 and route in HEDGED_ROUTES:
+                response = hedged_call(lambda: call(timeout), HEDGE_AFTER_MS / 1000, HTTP_POOL_SIZE)
+            else:
+                response = call(timeout)
+    except Exception:
+        breaker.record(False)
+        metrics.count('UpstreamError')
+        raise
+    breaker.record(response.status_code < 500)
+    metrics.count(f'UpstreamStatus{response.status_code // 100}xx')
+    return response
+
+def upstream_get(route, params, context=None):
+    '''
+    GET an upstream route through the pooled session.
+    '''
+    return call_upstream(
+        route,
+        lambda timeout: get_session().get(upstream_url(route), params=params, timeout=timeout),
+        context
+    )
+
+def upstream_post(route, body, context=None):
+    '''
+    POST a JSON body to an upstream route through the pooled session.
+    '''
+    return call_upstream(
+        route,
+        lambda timeout: get_session().post(upstream_url(route), json=body, timeout=timeout),
+        context
+    )
+
 
 def phone_to_words(phone):
     '''
     Convert a phone number to words.
     '''
-    p = phone.replace('+1', '').replace('-', '').replace(' ', '')
-    # Map digits to words
-    number_words = {
-        '0': 'zero',
-        '1': 'one', 
-        '2': 'two',
-        '3': 'three',
-        '4': 'four',
-        '5': 'five',
-        '6': 'six',
-        '7': 'seven',
-        '8': 'eight',
-        '9': 'nine'
-    }
-    
-    # Convert each digit to its word representation
-    words = [number_words[digit] for digit in p]
-    
-    # Join with spaces
-    return ' '.join(words)
+    return phone_words(phone)
+
+def parse_body(event):
+    '''
+    Return the JSON body of the event. It is parsed once per request and
+    kept on the event, so middleware and the handler share it.
+    '''
+    body = event.get('parsed_body', MISSING)
+    if body is MISSING:
+        with metrics.timer('Parse'):
+            body = event['parsed_body'] = json.loads(event['body'])
+    return body
+
+# Response building. Bodies are encoded with orjson when it is installed;
+# it is imported by the first dumps() call, not at cold start. Responses
+# that are mostly static are built from ResponseTemplate, which encodes the
+# fixed fields once at import with the json module and only encodes the
+# dynamic ones per call. dbg_* fields are only included when DEBUG_FIELDS
+# is true.
+DEBUG_FIELDS = os.getenv('DEBUG_FIELDS', 'false').lower() == 'true'
+DYNAMIC = object()
+_orjson = None
+
+
+def get_orjson():
+    '''
+    The orjson module, or False when it isn't installed.
+    '''
+    global _orjson
+    if _orjson is None:
+        try:
+            import orjson
+            _orjson = orjson
+        except ImportError:
+            _orjson = False
+    return _orjson
+
+def dumps(value):
+    orjson = _orjson if _orjson is not None else get_orjson()
+    if orjson:
+        try:
+            return orjson.dumps(value).decode()
+        except TypeError:
+            pass
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+def encode_static(value):
+    # Same output as orjson for the plain values templates hold.
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+class ResponseTemplate:
+    '''
+    JSON object whose field order and static values are fixed. Fields set
+    to DYNAMIC are filled in by render().
+    '''
+    def __init__(self, fields):
+        self._pieces = []
+        text = '{'
+        separator = ''
+        for key, value in fields.items():
+            if key.startswith('dbg_') and not DEBUG_FIELDS:
+                continue
+            text += separator + encode_static(key) + ':'
+            separator = ','
+            if value is DYNAMIC:
+                self._pieces.append((text, key))
+                text = ''
+            else:
+                text += encode_static(value)
+        self._tail = text + '}'
+
+    def render(self, **values):
+        return ''.join([text + dumps(values[key]) for text, key in self._pieces]) + self._tail
+
+
+def respond(status_code, payload):
+    with metrics.timer('Respond'):
+        return {
+            'statusCode': status_code,
+            'body': payload.render() if isinstance(payload, ResponseTemplate) else dumps(payload)
+        }
+
+def respond_template(status_code, template, **values):
+    with metrics.timer('Respond'):
+        return {
+            'statusCode': status_code,
+            'body': template.render(**values)
+        }
+
+
+DNC_SCRIPT = (
+    "Thank you for holding. At the moment, "
+    "I am unable to transfer you, "
+    "but I will send a message to the debt "
+    "consolidation expert to notify them that you called."
+    " Thank you for calling and enjoy your day! Bye.")
+TRANSFER_SCRIPT = 'Thank you for waiting.  I am transfering you now.'
+SPECIALIST_TRANSFER_SCRIPT = (
+    'Thank you for waiting.  I am going to connect with a specialist.  I am transfering you now.')
+DEFAULT_TRANSFER_NUMBER = '+19207728499'
+
+NO_PHONE_RESPONSE = ResponseTemplate({'dnc': False})
+BLACKLISTED_RESPONSE = ResponseTemplate({
+    'script': DNC_SCRIPT,
+    'black_listed': True
+})
+NOT_BLACKLISTED_RESPONSE = ResponseTemplate({
+    'script': DYNAMIC,
+    'black_listed': False,
+    'dbg_url_used': f'https://{ENDPOINT}/lead/blacklisted'
+})
+NO_PIN_RESPONSE = ResponseTemplate({'script': 'No personal key provided'})
+LEAD_NOT_FOUND_RESPONSE = ResponseTemplate({
+    'script': '~I did not find a record.',
+    'personFound': False
+})
+LEAD_FOUND_RESPONSE = ResponseTemplate({
+    'first_name': DYNAMIC,
+    'last_name': DYNAMIC,
+    'phone_number': DYNAMIC,
+    'email_address': DYNAMIC,
+    'address': DYNAMIC,
+    'line1': DYNAMIC,
+    'city': DYNAMIC,
+    'state': DYNAMIC,
+    'postcode': DYNAMIC,
+    'script': "Got it!",
+    'personFound': True,
+    'dbg_url_used': f'https://{ENDPOINT}/lead/lookup'
+})
+TRANSFER_RESPONSE = ResponseTemplate({
+    'transferNumber': DYNAMIC,
+    'buyerName': DYNAMIC,
+    'message': DYNAMIC,
+    'success': DYNAMIC,
+    'script': TRANSFER_SCRIPT,
+    'dbg_url_used': f'https://{ENDPOINT}/taalk/submit',
+    'dbg_body_used': DYNAMIC
+})
+DNC_RECORDED_RESPONSE = ResponseTemplate({
+    'script': DNC_SCRIPT,
+    'black_listed': True,
+    'dbg_url_used': f'https://{ENDPOINT}/taalk/dnc'
+})
+DNC_NOT_RECORDED_RESPONSE = ResponseTemplate({
+    'script': DYNAMIC,
+    'black_listed': False,
+    'dbg_url_used': f'https://{ENDPOINT}/taalk/dnc'
+})
 
 def lambda_handler(event, context):
+    '''
+    Lambda entry point. Metrics recorded while the event is handled are
+    emitted once, when it is done. Warm-up pings are answered here and
+    never reach a route.
+    '''
+    if is_warmup_event(event):
+        with log.scope(getattr(context, 'aws_request_id', None), 'warmup'), metrics.scope(Route='warmup'):
+            return respond(200, warm_up())
     path = event.get('rawPath', '')
-    if path == '/submit/lead':
-        return submit_lead_handler(event)
-    elif path == '/lead/lookup':
-        return lead_lookup_handler(event)
-    if path == '/taalk/dnc':
-        return dnc_handler(event, context)
-    if path == '/taalk/check/dnc':
-        return check_dnc_handler(event, context)
-    else:
-        return {
-            'statusCode': 404,
-            'body': json.dumps({'error': 'Not found'})
+    with log.scope(event_request_id(event, context), path), \
+            metrics.scope(Route=path), metrics.timer('Total'):
+        return route_event(event, context)
+
+async def lambda_handler_async(event, context):
+    # Each request logs and collects its metrics in its own scope, so
+    # concurrent requests on the ASGI server are kept apart. Requests
+    # without an id of their own get one, so their sub-calls can be traced.
+    path = event.get('rawPath', '')
+    with log.scope(event_request_id(event, context) or os.urandom(8).hex(), path), \
+            metrics.scope(Route=path), metrics.timer('Total'):
+        return await handle_async(event, context)
+
+def event_request_id(event, context):
+    return (
+        getattr(context, 'aws_request_id', None)
+        or (event.get('requestContext') or {}).get('requestId')
+    )
+
+def start_request(event, context, path):
+    log.start_request(event_request_id(event, context), path)
+
+def route_event(event, context):
+    path = event.get('rawPath', '')
+    start_request(event, context, path)
+    try:
+        return router.dispatch(event_method(event), path, event, context)
+    except HttpError as e:
+        return respond(e.status_code, {'error': str(e)})
+
+def event_method(event):
+    '''
+    HTTP method of a function URL / HTTP API (v2) or REST API (v1) event.
+    Events without one, e.g. sub-calls of /taalk/multi, only match ANY.
+    '''
+    http = (event.get('requestContext') or {}).get('http') or {}
+    return (http.get('method') or event.get('httpMethod') or '').upper()
+
+# Async core. The handlers use the pooled blocking session, so each request
+# runs on a shared executor sized to the connection pool and the event loop
+# overlaps them. lambda_handler stays synchronous; asgi_app.py serves the
+# same core as a standalone service.
+MULTI_MAX_CALLS = int(os.getenv('MULTI_MAX_CALLS', '10'))
+BATCH_MAX_RECORDS = int(os.getenv('BATCH_MAX_RECORDS', '1000'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _executor = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix='upstream')
+    return _executor
+
+async def handle_async(event, context):
+    '''
+    Route one event without blocking the event loop. Async routes run
+    their pipeline on the loop; the others, and a method an async route
+    doesn't answer, go through route_event on the executor.
+    '''
+    path = event.get('rawPath', '')
+    pipeline = async_router.resolve(event_method(event), path)
+    if pipeline is not None:
+        start_request(event, context, path)
+        return await pipeline(event, context)
+    import asyncio
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), log.bind(metrics.bind(route_event)), event, context)
+
+async def multi_handler_async(event, context):
+    '''
+    Run several tool calls from one request concurrently, e.g. a blacklist
+    check and a lead lookup for the same caller. The body looks like:
+
+        {"calls": [{"path": "/taalk/check/dnc", "body": {...}},
+                   {"path": "/lead/lookup", "query": {"pin": "1234"}}]}
+    '''
+    import asyncio
+    calls = json_object(event).get('calls', [])
+    if not isinstance(calls, list):
+        raise HttpError(400, '"calls" must be a list')
+    if len(calls) > MULTI_MAX_CALLS:
+        return respond(400, {'error': f'At most {MULTI_MAX_CALLS} calls are allowed'})
+    sub_events = []
+    for index, call in enumerate(calls):
+        if not isinstance(call, dict):
+            raise HttpError(400, f'Call {index} must be a JSON object')
+        path = call.get('path', '')
+        if not isinstance(path, str):
+            raise HttpError(400, f'Call {index} needs a path')
+        if path in async_router.methods:
+            return respond(400, {'error': f'{path} can not be called from /taalk/multi'})
+        body = call.get('body', {})
+        query = call.get('query', {})
+        if not isinstance(query, (dict, type(None))):
+            raise HttpError(400, f'Query of call {index} must be a JSON object')
+        sub_event = {
+            'rawPath': path,
+            'queryStringParameters': query,
+            'headers': sub_call_headers(event.get('headers'), index)
         }
+        # Decoded bodies are handed over as they are instead of being
+        # encoded here and parsed again by the route.
+        sub_event['body' if isinstance(body, str) else 'parsed_body'] = body
+        sub_events.append(sub_event)
+    try:
+        responses = await asyncio.gather(*(handle_async(e, context) for e in sub_events))
+        return respond(200, {
+            'results': [
+                {
+                    'path': sub_event['rawPath'],
+                    'statusCode': response['statusCode'],
+                    'body': json.loads(response['body'])
+                }
+                for sub_event, response in zip(sub_events, responses)
+            ]
+        })
+    except Exception as e:
+        return respond(500, {'error': str(e)})
 
-def check_dnc_handler(event, context):
+def sub_call_headers(headers, index):
+    '''
+    Headers of the `index`th call of a /taalk/multi request. An idempotency
+    key becomes one key per call, so different calls never share a stored
+    response while a retried multi request still replays each of them.
+    '''
+    from idempotency import header_key
+
+    headers = dict(headers or {})
+    key = header_key(headers, IDEMPOTENCY_HEADER)
+    if key is None:
+        return headers
+    name = IDEMPOTENCY_HEADER.lower()
+    headers = {k: v for k, v in headers.items() if k.lower() != name}
+    headers[IDEMPOTENCY_HEADER] = f'{key}:{index}'
+    return headers
+
+def parse_batch_records(raw):
+    '''
+    Parse a batch body given as a JSON array or as NDJSON. Lines that fail
+    to parse are returned as ValueError so they get their own error result.
+    Raises ValueError for an array holding arrays, which is a malformed
+    batch rather than a bad record.
+    '''
+    raw = (raw or '').strip()
+    if raw.startswith('['):
+        records = json.loads(raw)
+        for index, record in enumerate(records):
+            if isinstance(record, list):
+                raise ValueError(f'record {index} is an array, not an object')
+        return records
+    records = []
+    for line in raw.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError as e:
+            records.append(ValueError(f'Invalid JSON record: {e}'))
+    return records
+
+def is_failure(status_code, body):
+    '''
+    Whether a route's answer failed. Some routes answer 200 with an
+    `error`, or with `errors` for an invalid lead, so the caller still
+    gets a script.
+    '''
+    return status_code != 200 or not isinstance(body, dict) or 'error' in body or 'errors' in body
+
+async def batch_handler_async(event, context, path):
+    '''
+    Run every record of a batch through the single-record route at `path`,
+    with at most BATCH_CONCURRENCY upstream calls in flight. A failed record
+    gets its own error result and does not fail the batch.
+    '''
+    import asyncio
     try:
-        body = json.loads(event['body'])
-        phone = body.get('phone', None)
-        if not phone:
-            return {
-                'statusCode': 200,  
-                'body': json.dumps({
-                    'dnc': False
-                })
-            }
-        first_name = body.get('first_name')
-        last_name = body.get('last_name')
-        phone = body.get('phone', None)
-        person_found = body.get('person_found', False)
-        response = requests.get(
-            f'https://{ENDPOINT}/lead/blacklisted',  
+        records = parse_batch_records(event.get('body'))
+    except ValueError as e:
+        return respond(400, {'error': f'Invalid batch body: {e}'})
+    if not records:
+        return respond(400, {'error': 'Empty batch'})
+    if len(records) > BATCH_MAX_RECORDS:
+        return respond(400, {'error': f'At most {BATCH_MAX_RECORDS} records are allowed'})
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    query = event.get('queryStringParameters') or {}
+
+    async def run(index, record):
+        if isinstance(record, Exception):
+            return {'index': index, 'statusCode': 400, 'body': {'error': str(record)}}
+        if not isinstance(record, dict):
+            return {'index': index, 'statusCode': 400, 'body': {'error': 'Record must be a JSON object'}}
+        async with semaphore:
+            try:
+                response = await handle_async({
+                    'rawPath': path,
+                    'parsed_body': record,
+                    'queryStringParameters': query
+                }, context)
+            except Exception as e:
+                return {'index': index, 'statusCode': 500, 'body': {'error': str(e)}}
+        return {'index': index, 'statusCode': response['statusCode'], 'body': json.loads(response['body'])}
+
+    results = await asyncio.gather(*(run(i, r) for i, r in enumerate(records)))
+    failed = sum(1 for r in results if is_failure(r['statusCode'], r['body']))
+    return respond(200, {
+        'results': results,
+        'succeeded': len(results) - failed,
+        'failed': failed
+    })
+
+async def check_dnc_batch_handler_async(event, context):
+    return await batch_handler_async(event, context, '/taalk/check/dnc')
+
+async def submit_lead_batch_handler_async(event, context):
+    return await batch_handler_async(event, context, '/submit/lead')
+
+def check_dnc_handler(event, context):
+    body = parse_body(event)
+    first_name = body.get('first_name')
+    last_name = body.get('last_name')
+    phone = body.get('phone', None)
+    person_found = body.get('person_found', False)
+    cache_key = phone_key(phone)
+    blacklisted = MISSING if cache_key is None else dnc_cache.get(cache_key)
+    metrics.count('DncCacheMiss' if blacklisted is MISSING else 'DncCacheHit')
+    if blacklisted is MISSING and cache_key is not None:
+        dnc_index = get_dnc_index()
+        if dnc_index is not None:
+            indexed = dnc_index.lookup(cache_key)
+            if indexed is not None:
+                metrics.count('DncIndexHit')
+                blacklisted = indexed
+    if blacklisted is MISSING:
+        response = upstream_get(
+            '/lead/blacklisted',
             params={
                 'first_name': first_name,
                 'last_name': last_name,
                 'phone': phone
-            }
+            },
+            context=context
         )
         api_response = response.json()
+        blacklisted = bool(api_response.get('blacklisted', False))
+        if response.ok and cache_key is not None:
+            dnc_cache.set(cache_key, blacklisted, negative=not blacklisted)
 
-        if api_response.get('blacklisted', False):
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'script': (
-                        "Thank you for holding. At the moment, "
-                        "I am unable to transfer you, "
-                        "but I will send a message to the debt "
-                        "consolidation expert to notify them that you called."
-                        " Thank you for calling and enjoy your day! Bye."),
-                    'black_listed': True
-                })
-            }
-        else:
-            the_script = f"Thank you {first_name}! To get started, May I ask how much unsecured debt you have?"
-            if person_found:
-                the_script = f"Thank you for that {first_name}! And just to confirm, is {phone_to_words(phone)} the best mobile number to reach you with?"
-            
-            return {
-                'statusCode': 200, 
-                'body': json.dumps({
-                    'script': the_script,
-                    'black_listed': False,
-                    'dbg_url_used' : f'https://{ENDPOINT}/lead/blacklisted'
-                })
-            }
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'error': str(e)
-            })
-        }
-
-def clean_up_to_zipcode(zip_code):
-    '''
-    '''
-    if isinstance(zip_code, str):
-        zip_code = zip_code.replace('(', '').replace(')', '').replace('-', '')
-        number_map = {
-            'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4',
-            'five': '5', 'six': '6', 'seven': '7', 'eight': '8', 'nine': '9'
-        }
-        for word, digit in number_map.items():
-            zip_code = zip_code.replace(word, digit)
-        zip_code = zip_code.replace('-', '')
-        zip_code = zip_code.replace(' ', '')
-        try:
-            zip_code = int(zip_code)
-            return zip_code
-        except Exception as e:
-            print("Error converting number to int", zip_code)
-            return 0
+    if blacklisted:
+        return respond(200, BLACKLISTED_RESPONSE)
     else:
-        return zip_code
+        the_script = f"Thank you {first_name}! To get started, May I ask how much unsecured debt you have?"
+        if person_found:
+            the_script = f"Thank you for that {first_name}! And just to confirm, is {phone_to_words(phone)} the best mobile number to reach you with?"
         
-def clean_up_money_number(money_number):
-    '''
-    Convert word numbers like "sixty thousand" to digits
-    '''
-    if isinstance(money_number, str):
-        money_number = money_number.replace('(', '').replace(')', '').replace('-', '')
-        # Convert word numbers like "sixty thousand" to digits
-        try:
-            money_number = w2n.word_to_num(money_number)
-            money_number = int(money_number)
-            return money_number
-        except Exception as e:
-            import traceback
-            print("Traceback:")
-            print(traceback.format_exc())
-            print("Error converting number to int", money_number)
-            return 0
-    else:
-        return money_number
+        return respond_template(200, NOT_BLACKLISTED_RESPONSE, script=the_script)
 
 def clean_phone_number(phone):
     '''
     If the customer mentions the plus one one the phone, don't add it. 
     Most customer will not say +1. 
     '''
-    clean_phone=0
-    if isinstance(phone, int):
-        clean_phone = str(phone)
-    else:
-        phone = phone.replace('(', '').replace(')', '').replace('-', '').replace(' ', '')
-        try:
-            clean_phone = int(phone)
-        except Exception as e:
-            print("Error converting phone number to int", phone)
-            print(f"Exception occurred: {str(e)}")
-            return phone
-    # Add +1 prefix if missing
-    if isinstance(clean_phone, str):
-        if not clean_phone.startswith('+1'):
-            clean_phone = '+1' + clean_phone
-    else:
-        str_phone = str(clean_phone)
-        if not str_phone.startswith('+1'):
-            clean_phone = '+1' + str_phone
-    return clean_phone
+    result = normalize_phone(phone)
+    if result.value is None:
+        log.warning('Could not normalize phone number', phone=phone, error=result.error)
+        return phone
+    return result.value
 
 def clean_up_pin(pin):
     '''
@@ -185,299 +708,672 @@ def clean_up_pin(pin):
     elif pin is None:
         return None
     else:
-        pin = pin.replace('(', '').replace(')', '').replace('-', '').replace(',', '')
-        number_map = {
-            'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4',
-            'five': '5', 'six': '6', 'seven': '7', 'eight': '8', 'nine': '9'
-        }
-        for word, digit in number_map.items():
-            pin = pin.replace(word, digit)
-        pin = pin.replace('-', '')
-        pin = pin.replace(' ', '')
-        return pin
+        return normalize_pin(pin).value
 
-def lead_lookup_handler(event):
-    try:
-        # Parse request body
-        params = event.get('queryStringParameters', {}) or {}
+def lead_lookup_handler(event, context=None):
+    params = event.get('queryStringParameters', {}) or {}
+    with metrics.timer('Normalize'):
         pin = clean_up_pin(params.get('pin', None))
-        if not pin:
-            return {
-                'statusCode': 200,
-                'body': json.dumps(
-                    {
-                        'script': 'No personal key provided'
-                    }
-                )
-            }
-        # Extract parameters    
-        print("pin", pin)
-        print("ENDPOINT", f'https://{ENDPOINT}/lead/lookup')
-        response = requests.get(
-            f'https://{ENDPOINT}/lead/lookup',
+    if not pin:
+        return respond(200, NO_PIN_RESPONSE)
+    data = lookup_cache.get(str(pin))
+    metrics.count('LookupCacheMiss' if data is MISSING else 'LookupCacheHit')
+    log.debug('Lead lookup', pin=pin, cached=data is not MISSING)
+    if data is MISSING:
+        response = upstream_get(
+            '/lead/lookup',
             params={
                 'pin': pin
-            }
+            },
+            context=context
         )
         api_response = response.json()
         data = api_response.get('data', [])
-        if len(data) == 0:
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'script': '~I did not find a record.',
-                    'personFound' : False
-                })
-            }
-        else:
-            data = data[0]
-            return {
-                'statusCode': 200,
-                'body': json.dumps(
-                    {
-                    'first_name': data.get('first_name', ''),
-                    'last_name': data.get('last_name', ''),
-                    'phone_number': data.get('phone_numbers', [{}])[0].get('number',''),
-                    'email_address': data.get('email_addresses', [{}])[0].get('email_address'),
-                    'address': data.get('addresses', [{}])[0].get('address'),
-                    'line1' : data.get('addresses', [{}])[0].get('line1'),
-                    'city': data.get('addresses', [{}])[0].get('city'),
-                    'state': data.get('addresses', [{}])[0].get('state'),
-                    'postcode': data.get('addresses', [{}])[0].get('postcode'),    
-                    'script' : "Got it!",
-                    'personFound' : True,
-                    'dbg_url_used' : f'https://{ENDPOINT}/lead/lookup'
-                    }
-                )
-            }
+        if response.ok:
+            lookup_cache.set(str(pin), data[:1], negative=len(data) == 0)
+    if len(data) == 0:
+        return respond(200, LEAD_NOT_FOUND_RESPONSE)
+    else:
+        data = data[0]
+        address = data.get('addresses', [{}])[0]
+        return respond_template(
+            200,
+            LEAD_FOUND_RESPONSE,
+            first_name=data.get('first_name', ''),
+            last_name=data.get('last_name', ''),
+            phone_number=data.get('phone_numbers', [{}])[0].get('number',''),
+            email_address=data.get('email_addresses', [{}])[0].get('email_address'),
+            address=address.get('address'),
+            line1=address.get('line1'),
+            city=address.get('city'),
+            state=address.get('state'),
+            postcode=address.get('postcode')
+        )
+
+# Fields each submit variant requires. /submit/lead only needs enough to
+# route the caller; the older no-PIN flow collected full contact details.
+SUBMIT_REQUIRED = ('campaign_id', 'phone')
+SUBMIT_NO_PIN_REQUIRED = (
+    'campaign_id', 'pin', 'first_name', 'last_name', 'annual_income', 'email', 'phone'
+)
+
+
+def parse_submitted_lead(event, required):
+    '''
+    Parse and normalize the lead in the event body. Returns (lead, errors).
+    '''
+    with metrics.timer('Normalize'):
+        lead, errors = parse_lead(parse_body(event), required)
+    if lead.warnings:
+        log.warning('Could not normalize lead fields', warnings=lead.warnings)
+    return lead, errors
+
+def invalid_lead_response(errors):
+    return respond(200, {
+        'script': '. '.join(error['error'] for error in errors),
+        'errors': errors
+    })
+
+def default_transfer_number(event):
+    return (event.get('queryStringParameters') or {}).get('default_transfer_number', DEFAULT_TRANSFER_NUMBER)
+
+def submit_lead(event, context, required, fallback_transfer):
+    '''
+    Submit the lead in the event to /taalk/submit. The route pipeline
+    leaves the parsed lead in event['model']; a direct call parses it here.
+    With `fallback_transfer`, a missing transfer number in the answer is
+    replaced with the default one.
+    '''
+    lead = event.get('model')
+    if lead is None:
+        lead, errors = parse_submitted_lead(event, required)
+        if errors:
+            return invalid_lead_response(errors)
+    body = lead.to_upstream()
+
+    response = upstream_post(
+        '/taalk/submit',
+        body,
+        context=context
+    )
+    api_response = response.json()
+    # Only ids, the status and the timing: the lead and the buyer's answer
+    # carry names, addresses and amounts.
+    log.debug(
+        'Submitted lead',
+        status=response.status_code,
+        success=api_response.get('success'),
+        lead_id=lambda: api_response.get('lead_id') or api_response.get('id'),
+        campaign_id=body.get('campaign_id'),
+        upstream_ms=lambda: round(response.elapsed.total_seconds() * 1000, 1)
+    )
+    try: 
+        phoneNumber = clean_phone_number(api_response.get('buyer', {}).get("transfer_number", ""))
+        if not phoneNumber and fallback_transfer:
+            metrics.count('Fallback')
+            phoneNumber = default_transfer_number(event)
+    except Exception as et: 
+        if not fallback_transfer:
+            raise
+        metrics.count('Fallback')
+        phoneNumber = default_transfer_number(event)
+        log.exception('Could not read transfer number', error=str(et))
+    return respond_template(
+        200,
+        TRANSFER_RESPONSE,
+        transferNumber=phoneNumber,
+        buyerName=api_response.get('buyer', {}).get("name", ""),
+        message=api_response.get('message', ""),
+        success=api_response.get('success', False),
+        dbg_body_used=body
+    )
+
+def submit_lead_handler(event, context=None):
+    return submit_lead(event, context, SUBMIT_REQUIRED, fallback_transfer=True)
+
+def submit_lead_handler_no_pin(event, context=None):
+    try:
+        return submit_lead(event, context, SUBMIT_NO_PIN_REQUIRED, fallback_transfer=False)
     except Exception as e:
-        import traceback
-        print(f"Exception occurred: {str(e)}")
-        print("Traceback:")
-        print(traceback.format_exc())
-        return {
-            'statusCode': 500,
-            'body': json.dumps({'error': str(e)})
-        }
+        log_error(e)
+        return respond(500, {'error': str(e)})
 
-def clean_up_date_of_birth(date_of_birth):
+def submit_lead_fallback(event, error):
     '''
-    Convert word numbers like "sixty thousand" to digits
+    Error response of /submit/lead: the caller is still transferred, to
+    the default number.
     '''
-    if not date_of_birth:
-        return ""
+    metrics.count('Fallback')
+    return respond(200, {
+        'error': str(error),
+        'transferNumber': default_transfer_number(event),
+        'script': SPECIALIST_TRANSFER_SCRIPT
+    })
+
+# DNC writes. DNC_WRITE_MODE is "sync" (call /taalk/dnc and report its
+# answer), "write_behind" (spool the request and answer right away) or
+# "fallback" (call, and spool the request if the upstream fails). Spooled
+# requests are delivered by a background drain, see dnc_spool.py.
+# DNC_SPOOL picks the spool: "sqs:<queue url>,<dead letter queue url>",
+# "file:<path>" or "memory". On Lambda /tmp only lives as long as the
+# container, so the file spool at DNC_SPOOL_PATH, used when DNC_SPOOL is
+# not set, is for local runs and tests.
+DNC_WRITE_MODE = os.getenv('DNC_WRITE_MODE', 'sync').lower()
+DNC_SPOOL = os.getenv('DNC_SPOOL', '')
+DNC_SPOOL_PATH = os.getenv('DNC_SPOOL_PATH', '/tmp/dnc-spool.jsonl')
+DNC_SPOOL_BATCH = int(os.getenv('DNC_SPOOL_BATCH', '25'))
+DNC_SPOOL_MAX_ATTEMPTS = int(os.getenv('DNC_SPOOL_MAX_ATTEMPTS', '20'))
+DNC_SPOOL_RETRY_DELAY = float(os.getenv('DNC_SPOOL_RETRY_DELAY', '1'))
+DNC_SPOOL_MAX_RETRY_DELAY = float(os.getenv('DNC_SPOOL_MAX_RETRY_DELAY', '60'))
+
+_dnc_spool = None
+_dnc_drain_thread = None
+_dnc_spool_lock = threading.Lock()
+
+
+def get_dnc_spool():
+    global _dnc_spool
+    with _dnc_spool_lock:
+        if _dnc_spool is None:
+            from dnc_spool import open_spool
+            _dnc_spool = open_spool(DNC_SPOOL or f'file:{DNC_SPOOL_PATH}')
+    return _dnc_spool
+
+def mark_blacklisted(phone, pending=False):
+    '''
+    Make follow-up DNC checks see this number as blacklisted right away.
+    `pending` marks a spooled request, which the index keeps until the
+    drain delivers it (see confirm_blacklisted).
+    '''
+    cache_key = phone_key(phone)
+    if cache_key is None:
+        return
+    # Replace any cached "not blacklisted" answer for this number.
+    dnc_cache.set(cache_key, True)
+    dnc_index = get_dnc_index()
+    if dnc_index is not None:
+        from dnc_index import phone_to_int
+        number = phone_to_int(cache_key)
+        if number is not None:
+            dnc_index.add(number, pending)
+
+def confirm_blacklisted(phone, accepted):
+    '''
+    Settle the index entry of a spooled request once it was delivered.
+    '''
+    dnc_index = get_dnc_index()
+    if dnc_index is not None:
+        from dnc_index import phone_to_int
+        number = phone_to_int(phone)
+        if number is not None:
+            dnc_index.confirm(number, accepted)
+
+def send_spooled_dnc(record):
+    response = upstream_post('/taalk/dnc', {
+        'campaign_id': record['campaign_id'],
+        'first_name': record['first_name'],
+        'last_name': record['last_name'],
+        'phone': record['phone']
+    })
+    if response.status_code >= 500:
+        raise RuntimeError(f'/taalk/dnc answered {response.status_code}')
+    accepted = bool(response.json().get('success'))
+    confirm_blacklisted(record['phone'], accepted)
+    if not accepted:
+        # Not retried: the upstream looked at the request and turned it down.
+        log.warning('Spooled DNC request was not accepted', phone=record['phone'])
+
+def drain_dnc_spool():
+    '''
+    Deliver spooled DNC requests until the spool is empty, backing off
+    while deliveries fail.
+    '''
+    global _dnc_drain_thread
+    from dnc_spool import drain
+
+    spool = get_dnc_spool()
+    delay = DNC_SPOOL_RETRY_DELAY
+    while True:
+        with metrics.scope(Route='dnc-drain'):
+            try:
+                stats = drain(
+                    spool,
+                    metrics.bind(send_spooled_dnc),
+                    batch_size=DNC_SPOOL_BATCH,
+                    max_attempts=DNC_SPOOL_MAX_ATTEMPTS,
+                    map_batch=get_executor().map
+                )
+            except Exception as e:
+                log.exception('Error draining DNC spool', error=str(e))
+                with _dnc_spool_lock:
+                    _dnc_drain_thread = None
+                return
+            if stats['sent'] or stats['retry'] or stats['dead']:
+                metrics.count('DncSpoolSent', stats['sent'])
+            if stats['dead']:
+                metrics.count('DncSpoolDeadLetter', stats['dead'])
+                log.error('DNC requests moved to the dead letter file', count=stats['dead'])
+        if stats['retry']:
+            time.sleep(delay)
+            delay = min(delay * 2, DNC_SPOOL_MAX_RETRY_DELAY)
+        elif not stats['sent']:
+            # Only stop once nothing was appended meanwhile; spool_dnc
+            # starts a new drain for anything appended after this check.
+            with _dnc_spool_lock:
+                if not len(spool):
+                    _dnc_drain_thread = None
+                    return
+        else:
+            delay = DNC_SPOOL_RETRY_DELAY
+
+def start_dnc_drain():
+    '''
+    Start draining the spool in the background unless a drain is running.
+    '''
+    global _dnc_drain_thread
+    with _dnc_spool_lock:
+        if _dnc_drain_thread is not None:
+            return
+        _dnc_drain_thread = threading.Thread(target=drain_dnc_spool, name='dnc-drain', daemon=True)
+        _dnc_drain_thread.start()
+
+def spool_dnc(request):
+    from dnc_spool import new_record
+
+    get_dnc_spool().append(new_record(request))
+    metrics.count('DncSpooled')
+    mark_blacklisted(request['phone'], pending=True)
+    start_dnc_drain()
+    return respond(200, DNC_RECORDED_RESPONSE)
+
+def dnc_handler(event, context):
+    body = parse_body(event)
     
-    try:
-        # Try to parse the date to validate format
-        datetime.strptime(date_of_birth, '%m/%d/%Y')
-        return date_of_birth
-    except ValueError:
-        return ""
+    # Extract parameters
+    first_name = body.get('first_name')
+    last_name = body.get('last_name')
+    phone = body.get('phone', None)
+    person_found = body.get('person_found', False)
+    campaign_id = body.get('campaign_id', 4)
 
-def submit_lead_handler_no_pin(event):
+    # Capitalize first letter of names
+    first_name = first_name.capitalize()
+    last_name = last_name.capitalize()
+    request = {
+        'campaign_id': campaign_id,
+        'first_name': first_name,
+        'last_name': last_name,
+        'phone': phone
+    }
+    if DNC_WRITE_MODE == 'write_behind':
+        return spool_dnc(request)
+    # Call blacklist API
     try:
-        body = json.loads(event['body'])
-
-        required_fields = [
-            'campaign_id', 
-            'pin', 
-            'first_name', 
-            'last_name', 
-            'annual_income', 
-            'email', 
-            'phone'
-        ]
-        
-        # Check if all required fields are present
-        for field in required_fields:
-            if field not in body:
-                return {
-                    'statusCode': 200,
-                    'body': json.dumps({
-                        'script': f'Missing required field: {field}'
-                    })
-                }
-        url = f'https://{ENDPOINT}/taalk/submit'
-        body['pin'] = clean_up_pin(body['pin'])
-        body['annual_income'] = clean_up_money_number(body['annual_income'])
-        body['date_of_birth'] = clean_up_date_of_birth(body.get('date_of_birth', ''))
-        response = requests.post(
-            url,
-            json=body
-        )
-        print(url)
-        print( body)
-
-        api_response = response.json()
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'transferNumber' : clean_phone_number(api_response.get('buyer', {}).get("transfer_number", "")),
-                'buyerName' : api_response.get('buyer', {}).get("name", ""),
-                'message' : api_response.get('message', ""),
-                'success' : api_response.get('success', False),
-                'script': 'Thank you for waiting.  I am transfering you now.',
-                'dbg_url_used' : url,
-                'dbg_body_used' : body
-            })
-        }
+        response = upstream_post('/taalk/dnc', request, context=context)
+        if response.status_code >= 500 and DNC_WRITE_MODE == 'fallback':
+            raise RuntimeError(f'/taalk/dnc answered {response.status_code}')
     except Exception as e:
-        import traceback
-        print(f"Exception occurred: {str(e)}")
-        print("Traceback:")
-        print(traceback.format_exc())
-        return {
-            'statusCode': 500,
-            'body': json.dumps({'error': str(e)})
-        }   
+        if DNC_WRITE_MODE != 'fallback':
+            raise
+        log.warning('Spooling DNC request after upstream failure', error=str(e))
+        return spool_dnc(request)
     
-def submit_lead_handler(event):
-    try:
-        body = json.loads(event['body'])
-
-        required_fields = [
-            'campaign_id', 
-            'phone'
-        ]
-        
-        # Check if all required fields are present
-        for field in required_fields:
-            if field not in body:
-                return {
-                    'statusCode': 200,
-                    'body': json.dumps({
-                        'script': f'Missing required field: {field}'
-                    })
-                }
-        url = f'https://{ENDPOINT}/taalk/submit'
-        if 'pin' in body and body['pin']:
-            body['pin'] = clean_up_pin(body['pin'])
-        if 'annual_income' in body:
-            body['annual_income'] = clean_up_money_number(body['annual_income'])
-        if 'unsecured_debt' in body:
-            body['unsecured_debt'] = clean_up_money_number(body['unsecured_debt'])
-        if 'postcode' in body:
-            body['postcode'] = clean_up_to_zipcode(body['postcode'])
-        if 'date_of_birth' in body:
-            body['date_of_birth'] = clean_up_date_of_birth(body.get('date_of_birth', ''))
-
-        default_transfer_number = event.get('queryStringParameters', {}).get('default_transfer_number', '+19207728499')
-
-        print( "url for taalk/submit", url)
-        print("body for taalk/submit", body)
-        
-        response = requests.post(
-            url,
-            json=body
-        )
-        api_response = response.json()
+    api_response = response.json()
+    
+    if api_response.get('success'):
+        mark_blacklisted(phone)
+        return respond(200, DNC_RECORDED_RESPONSE)
+    else:
+        the_script = f"Thank you {first_name}! To get started, May I ask how much unsecured debt you have?"
+        if person_found:
+            the_script = f"Thank you for that {first_name}! And just to confirm, is {phone_to_words(phone)} the best mobile number to reach you with?"
         
-        print("status code for taalk/submit", response.status_code)
-
-        print("response body for taalk/submit", api_response)
-        try: 
-            phoneNumber = clean_phone_number(api_response.get('buyer', {}).get("transfer_number", ""))
-            if not phoneNumber:
-                phoneNumber = default_transfer_number
-        except Exception as et: 
-            import traceback
-            phoneNumber = default_transfer_number
-            print(f"Exception occurred: {str(et)}")
-            print("Traceback:")
-            print(traceback.format_exc())
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'transferNumber' : phoneNumber,
-                'buyerName' : api_response.get('buyer', {}).get("name", ""),
-                'message' : api_response.get('message', ""),
-                'success' : api_response.get('success', False),
-                'script': 'Thank you for waiting.  I am transfering you now.',
-                'dbg_url_used' : url,
-                'dbg_body_used' : body
-            })
-        }
-    except Exception as e:
-        import traceback
-        print(f"Exception occurred: {str(e)}")
-        print("Traceback:")
-        print(traceback.format_exc())
-        return {
-            'statusCode': 200,
-            'body': json.dumps({'error': str(e)}),  
-            'transferNumber' : default_transfer_number,
-            'script': 'Thank you for waiting.  I am going to connect with a specialist.  I am transfering you now.'
-        }    
+        return respond_template(200, DNC_NOT_RECORDED_RESPONSE, script=the_script)
 
-def dnc_handler(event, context):
+# Routing. Each route's pipeline is built from its entry in ROUTES:
+#   methods     HTTP methods it answers, ANY by default
+#   body        parse the JSON body once before the handler runs
+#   required    body fields that must be present and non-empty; on_missing
+#               builds the response for the first one that isn't
+#   model       function that parses the body into (model, errors); the
+#               model is left in event['model'] and on_invalid builds the
+#               response when there are errors
+#   idempotent  coalesce identical requests and replay stored responses
+#   on_error    turns an exception into a response (error_response by default)
+#   async       the handler is a coroutine on the async core; it runs through
+#               the same pipeline, which takes none of the body options above
+# Every route also gets the deadline check and status metrics.
+
+# Idempotent routes take the key from IDEMPOTENCY_HEADER, or hash the
+# normalized body and query. Responses below 500 without an error are
+# replayed for IDEMPOTENCY_TTL seconds. IDEMPOTENCY_STORE is "memory" or
+# "sqlite:<path>".
+IDEMPOTENCY_HEADER = os.getenv('IDEMPOTENCY_HEADER', 'Idempotency-Key')
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', '600'))
+IDEMPOTENCY_STORE = os.getenv('IDEMPOTENCY_STORE', 'memory')
+
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+
+def get_coalescer():
+    global _coalescer
+    with _coalescer_lock:
+        if _coalescer is None:
+            from idempotency import Coalescer, open_store
+            _coalescer = Coalescer(open_store(IDEMPOTENCY_STORE), IDEMPOTENCY_TTL)
+    return _coalescer
+
+def error_response(event, error):
+    if isinstance(error, HttpError):
+        return respond(error.status_code, {'error': str(error)})
+    if isinstance(error, CircuitOpenError):
+        return respond(503, {'error': str(error)})
+    return respond(500, {'error': str(error)})
+
+def log_error(error):
+    '''
+    Log an exception a route turns into a response. An open breaker or a
+    failed upstream call is expected while the upstream is down and gets
+    one warning line; anything else is logged with its traceback.
+    '''
+    if isinstance(error, HttpError):
+        return
+    if isinstance(error, CircuitOpenError):
+        log.warning('Upstream unavailable', error=str(error))
+        return
+    from requests import RequestException
+    if isinstance(error, RequestException):
+        log.warning('Upstream call failed', error=str(error), error_type=type(error).__name__)
+        return
+    log.exception('Exception occurred', error=str(error))
+
+def map_errors(on_error):
+    def middleware(handler):
+        if is_async(handler):
+            async def handle(event, context):
+                try:
+                    return await handler(event, context)
+                except Exception as e:
+                    log_error(e)
+                    return on_error(event, e)
+            return handle
+
+        def handle(event, context):
+            try:
+                return handler(event, context)
+            except Exception as e:
+                log_error(e)
+                return on_error(event, e)
+        return handle
+    return middleware
+
+def count_status(handler):
+    if is_async(handler):
+        async def handle(event, context):
+            response = await handler(event, context)
+            metrics.count(f'Status{response["statusCode"] // 100}xx')
+            return response
+        return handle
+
+    def handle(event, context):
+        response = handler(event, context)
+        metrics.count(f'Status{response["statusCode"] // 100}xx')
+        return response
+    return handle
+
+def deadline_passed(context):
+    remaining = remaining_seconds(context, DEADLINE_MARGIN)
+    return remaining is not None and remaining <= 0
+
+def check_deadline(handler):
+    if is_async(handler):
+        async def handle(event, context):
+            if deadline_passed(context):
+                raise HttpError(504, 'Not enough time left to handle the request')
+            return await handler(event, context)
+        return handle
+
+    def handle(event, context):
+        if deadline_passed(context):
+            raise HttpError(504, 'Not enough time left to handle the request')
+        return handler(event, context)
+    return handle
+
+def json_object(event):
+    '''
+    The parsed body of `event`. Raises HttpError 400 unless it is a JSON
+    object.
+    '''
     try:
-        # Parse request body
-        body = json.loads(event['body'])
-        
-        # Extract parameters
-        first_name = body.get('first_name')
-        last_name = body.get('last_name')
-        phone = body.get('phone', None)
-        person_found = body.get('person_found', False)
-        campaign_id = body.get('campaign_id', 4)
-        # Validate required fields
-        if not first_name or not last_name or not phone:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({
-                    'error': 'Missing required fields: first_name, last_name, and phone are required'
-                })
-            }
-
-        # Capitalize first letter of names
-        first_name = first_name.capitalize()
-        last_name = last_name.capitalize()
-        # Call blacklist API
-        response = requests.post(
-            f'https://{ENDPOINT}/taalk/dnc',
-            json={
-                'campaign_id': campaign_id,
-                'first_name': first_name,
-                'last_name': last_name,
-                'phone': phone
-            }
+        body = parse_body(event)
+    except (TypeError, ValueError) as e:
+        raise HttpError(400, f'Invalid JSON body: {e}')
+    if not isinstance(body, dict):
+        raise HttpError(400, 'Request body must be a JSON object')
+    return body
+
+def json_body(handler):
+    def handle(event, context):
+        json_object(event)
+        return handler(event, context)
+    return handle
+
+def require_fields(fields, on_missing):
+    def middleware(handler):
+        def handle(event, context):
+            body = parse_body(event)
+            for field in fields:
+                if body.get(field) in (None, ''):
+                    return on_missing(field)
+            return handler(event, context)
+        return handle
+    return middleware
+
+def parse_model(parse, on_invalid):
+    def middleware(handler):
+        def handle(event, context):
+            model, errors = parse(event)
+            if errors:
+                return on_invalid(errors)
+            event['model'] = model
+            return handler(event, context)
+        return handle
+    return middleware
+
+def idempotency_key(event):
+    from idempotency import body_key, header_key
+
+    key = header_key(event.get('headers'), IDEMPOTENCY_HEADER)
+    if key is None:
+        model = event.get('model')
+        key = body_key({
+            'body': parse_body(event) if model is None else model.to_upstream(),
+            'query': event.get('queryStringParameters') or {}
+        })
+    return f"{event.get('rawPath', '')}:{key}"
+
+def replayable(response):
+    return response['statusCode'] < 500 and 'error' not in json.loads(response['body'])
+
+def idempotent(handler):
+    def handle(event, context):
+        response, source = get_coalescer().run(
+            idempotency_key(event),
+            lambda: handler(event, context),
+            replayable,
+            timeout=remaining_seconds(context, DEADLINE_MARGIN)
         )
-        
-        api_response = response.json()
-        
-        if api_response.get('success'):
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'script': (
-                        "Thank you for holding. At the moment, "
-                        "I am unable to transfer you, "
-                        "but I will send a message to the debt "
-                        "consolidation expert to notify them that you called."
-                        " Thank you for calling and enjoy your day! Bye."),
-                    'black_listed': True,
-                    'dbg_url_used' : f'https://{ENDPOINT}/taalk/dnc'
-                })
-            }
-        else:
-            the_script = f"Thank you {first_name}! To get started, May I ask how much unsecured debt you have?"
-            if person_found:
-                the_script = f"Thank you for that {first_name}! And just to confirm, is {phone_to_words(phone)} the best mobile number to reach you with?"
-            
-            return {
-                'statusCode': 200, 
-                'body': json.dumps({
-                    'script': the_script,
-                    'black_listed': False,
-                    'dbg_url_used' : f'https://{ENDPOINT}/taalk/dnc'
-                })
-            }
-            
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'error': str(e)
-            })
-        }
+        if source != 'called':
+            metrics.count('IdempotentStored' if source == 'stored' else 'IdempotentCoalesced')
+            log.info('Replayed response of an identical request', source=source)
+        return response
+    return handle
+
+def run_async(handler):
+    def run(event, context):
+        import asyncio
+        return asyncio.run(handler(event, context))
+    return run
+
+ROUTES = {
+    '/submit/lead': {
+        'handler': submit_lead_handler,
+        'body': True,
+        'model': lambda event: parse_submitted_lead(event, SUBMIT_REQUIRED),
+        'on_invalid': invalid_lead_response,
+        'idempotent': True,
+        'on_error': submit_lead_fallback,
+    },
+    '/lead/lookup': {
+        'handler': lead_lookup_handler,
+    },
+    '/taalk/dnc': {
+        'handler': dnc_handler,
+        'body': True,
+        'required': ('first_name', 'last_name', 'phone'),
+        'on_missing': lambda field: respond(400, {
+            'error': 'Missing required fields: first_name, last_name, and phone are required'
+        }),
+    },
+    '/taalk/check/dnc': {
+        'handler': check_dnc_handler,
+        'body': True,
+        'required': ('phone',),
+        'on_missing': lambda field: respond(200, NO_PHONE_RESPONSE),
+    },
+    '/taalk/multi': {
+        'handler': multi_handler_async,
+        'async': True,
+    },
+    '/taalk/check/dnc/batch': {
+        'handler': check_dnc_batch_handler_async,
+        'async': True,
+    },
+    '/submit/lead/batch': {
+        'handler': submit_lead_batch_handler_async,
+        'async': True,
+    },
+}
+
+def build_router(routes, asynchronous=False):
+    '''
+    Router for `routes`. Async handlers are run to completion with
+    run_async, unless `asynchronous` is set and their pipelines are left as
+    coroutines for the async core.
+    '''
+    router = Router([count_status])
+    for path, config in routes.items():
+        middleware = [map_errors(config.get('on_error', error_response)), check_deadline]
+        if config.get('body'):
+            middleware.append(json_body)
+        if config.get('required'):
+            middleware.append(require_fields(config['required'], config['on_missing']))
+        if config.get('model'):
+            middleware.append(parse_model(config['model'], config['on_invalid']))
+        if config.get('idempotent'):
+            middleware.append(idempotent)
+        handler = config['handler']
+        if config.get('async') and not asynchronous:
+            handler = run_async(handler)
+        router.add(path, handler, config.get('methods', (ANY,)), middleware)
+    return router
+
+router = build_router(ROUTES)
+# Routes implemented directly on the async core, with coroutine pipelines.
+async_router = build_router({path: config for path, config in ROUTES.items() if config.get('async')}, True)
+
+
+# Warm-up. A scheduled ping (an EventBridge "Scheduled Event" or any event
+# with a "warmup" key) runs warm_up() instead of a route, and with
+# WARMUP_ON_INIT=true it also runs while the container initializes, which is
+# not billed against a caller under provisioned concurrency.
+WARMUP_ON_INIT = os.getenv('WARMUP_ON_INIT', 'false').lower() == 'true'
+# Spoken samples that take every normalizer through its slow path once.
+WARMUP_SAMPLES = {
+    'annual_income': 'one hundred and twenty five thousand',
+    'postcode': 'six two seven oh one',
+    'pin': 'double one two three',
+    'date_of_birth': '01/31/1980'
+}
+
+
+def is_warmup_event(event):
+    return 'warmup' in event or (
+        event.get('source') == 'aws.events' and event.get('detail-type') == 'Scheduled Event')
+
+# Modules the routes import on first use.
+WARM_MODULES = ('asyncio', 'concurrent.futures', 'datetime', 'requests')
+
+
+def _warm_imports():
+    import importlib
+
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+    get_orjson()
+
+def _warm_connection():
+    # Any HTTP answer means the TCP and TLS connection is up and pooled.
+    response = get_session().head(
+        upstream_url('/'),
+        timeout=(HTTP_CONNECT_TIMEOUT, HTTP_CONNECT_TIMEOUT)
+    )
+    return {'status': response.status_code}
+
+def _warm_dnc_index():
+    dnc_index = get_dnc_index()
+    if dnc_index is None:
+        return {'loaded': False}
+    # Fault in the Bloom filter and array pages touched by a lookup.
+    dnc_index.lookup('5550000000')
+    return {'loaded': True, 'count': dnc_index.count}
+
+def _warm_dnc_spool():
+    # Deliver requests spooled before this container was last frozen.
+    if DNC_WRITE_MODE == 'sync':
+        return {'pending': 0}
+    pending = len(get_dnc_spool())
+    if pending:
+        start_dnc_drain()
+    return {'pending': pending}
+
+def _warm_normalizers():
+    parse_lead(WARMUP_SAMPLES)
+    phone_to_words('five five five one two three four five six seven')
+
+WARMUP_STEPS = (
+    ('imports', _warm_imports),
+    ('connection', _warm_connection),
+    ('dnc_index', _warm_dnc_index),
+    ('dnc_spool', _warm_dnc_spool),
+    ('normalizers', _warm_normalizers),
+    ('executor', get_executor),
+    ('idempotency', get_coalescer),
+)
+
+def warm_up():
+    '''
+    Prepare this container for traffic: import the lazily loaded modules,
+    open and verify the pooled connection to ENDPOINT, load the DNC index
+    and run the normalizers once. A failing step is reported and the rest
+    still run. Returns the time each step took in ms.
+    '''
+    steps = {}
+    for name, step in WARMUP_STEPS:
+        start = time.perf_counter()
+        try:
+            result = step()
+            report = result if isinstance(result, dict) else {}
+            report['ok'] = True
+        except Exception as e:
+            report = {'ok': False, 'error': str(e)}
+        report['ms'] = round((time.perf_counter() - start) * 1000, 3)
+        metrics.record(f'Warmup:{name}', report['ms'])
+        steps[name] = report
+    log.info('Warm-up finished', steps=steps)
+    return {'warmup': True, 'ok': all(r['ok'] for r in steps.values()), 'steps': steps}
 
+if WARMUP_ON_INIT:
+    with metrics.scope(Route='init'):
+        warm_up()
@@ -0,0 +1,137 @@
+'''
+Lead payload model for /taalk/submit.
+
+FIELDS declares every known lead field with the function that normalizes
+its value. parse_lead() walks the payload once, normalizing known fields
+into a Lead and keeping unknown ones as they are, and reports every
+invalid or missing field together. Values that can't be normalized but
+don't make the lead invalid, like an unclear spoken amount, are kept as
+warnings, the same best effort the handlers always made.
+'''
+from normalizer import normalize_amount, normalize_pin, normalize_zipcode
+
+MISSING = object()
+
+
+class Field:
+    __slots__ = ('name', 'normalize')
+
+    def __init__(self, name, normalize=None):
+        self.name = name
+        self.normalize = normalize
+
+
+def _scalar(value):
+    if isinstance(value, (dict, list)):
+        raise ValueError('must be a single value')
+    return value, None
+
+def _identifier(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError('must be a number or text')
+    return value, None
+
+def _pin(value):
+    if value is None or value == '' or isinstance(value, int):
+        return value, None
+    if not isinstance(value, str):
+        raise ValueError('must be a number or text')
+    result = normalize_pin(value)
+    return result.value, result.error
+
+def _amount(value):
+    if isinstance(value, bool):
+        raise ValueError('must be a number or text')
+    if value is None or isinstance(value, (int, float)):
+        return value, None
+    if not isinstance(value, str):
+        raise ValueError('must be a number or text')
+    result = normalize_amount(value)
+    return result.value, result.error
+
+def _zipcode(value):
+    if value is None or isinstance(value, int):
+        return value, None
+    if not isinstance(value, str):
+        raise ValueError('must be a number or text')
+    result = normalize_zipcode(value)
+    return (result.value, None) if result.ok else (0, result.error)
+
+def _date_of_birth(value):
+    if not value:
+        return '', None
+    if not isinstance(value, str):
+        return '', 'Expected a MM/DD/YYYY date'
+    from datetime import datetime
+
+    try:
+        datetime.strptime(value, '%m/%d/%Y')
+        return value, None
+    except ValueError:
+        return '', 'Expected a MM/DD/YYYY date'
+
+FIELDS = (
+    Field('campaign_id', _identifier),
+    Field('pin', _pin),
+    Field('first_name', _scalar),
+    Field('last_name', _scalar),
+    Field('email', _scalar),
+    Field('phone', _identifier),
+    Field('annual_income', _amount),
+    Field('unsecured_debt', _amount),
+    Field('postcode', _zipcode),
+    Field('date_of_birth', _date_of_birth),
+)
+FIELDS_BY_NAME = {field.name: field for field in FIELDS}
+
+
+class Lead:
+    '''
+    A normalized lead. Known fields that weren't sent hold MISSING; unknown
+    fields are kept in `extra` and passed through to the upstream.
+    '''
+    __slots__ = tuple(FIELDS_BY_NAME) + ('extra', 'warnings')
+
+    def __init__(self):
+        for name in FIELDS_BY_NAME:
+            setattr(self, name, MISSING)
+        self.extra = {}
+        self.warnings = []
+
+    def to_upstream(self):
+        '''
+        JSON-ready dict for /taalk/submit.
+        '''
+        body = {}
+        for name in FIELDS_BY_NAME:
+            value = getattr(self, name)
+            if value is not MISSING:
+                body[name] = value
+        body.update(self.extra)
+        return body
+
+
+def parse_lead(body, required=()):
+    '''
+    Build a Lead from a decoded JSON body. Returns (lead, errors), where
+    errors lists every problem as {'field': ..., 'error': ...}.
+    '''
+    lead = Lead()
+    errors = []
+    for key, value in body.items():
+        field = FIELDS_BY_NAME.get(key)
+        if field is None:
+            lead.extra[key] = value
+            continue
+        try:
+            value, warning = field.normalize(value)
+        except ValueError as e:
+            errors.append({'field': key, 'error': f'Invalid value for {key}: {e}'})
+            continue
+        if warning is not None:
+            lead.warnings.append({'field': key, 'warning': warning})
+        setattr(lead, key, value)
+    for name in required:
+        if getattr(lead, name) in (MISSING, None, '') and not any(e['field'] == name for e in errors):
+            errors.append({'field': name, 'error': f'Missing required field: {name}'})
+    return lead, errors
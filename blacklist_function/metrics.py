@@ -0,0 +1,179 @@
+'''
+In-process timers and counters, emitted once per invocation.
+
+Timers and counters are aggregated in a collector while a request is
+handled and flush() writes them as a single CloudWatch Embedded Metric
+Format (EMF) line, or hands them to another sink set with set_sink(). A
+timer span costs two perf_counter_ns() calls and a list append.
+
+Each request gets its own collector with scope(), held in a context
+variable, so concurrent requests on the ASGI server don't mix their
+metrics. Threads don't inherit it: functions handed to another thread are
+wrapped with bind(). Anything recorded outside a scope goes to a process
+collector under the "background" route, emitted when the next scope ends.
+'''
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+NAMESPACE = os.getenv('METRICS_NAMESPACE', 'BlacklistFunction')
+ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+# EMF accepts at most 100 values per metric in one line.
+MAX_VALUES = 100
+
+
+class _Collector:
+    __slots__ = ('timings', 'counts', 'dimensions', 'lock')
+
+    def __init__(self, dimensions=None):
+        self.timings = {}
+        self.counts = {}
+        self.dimensions = dict(dimensions or {})
+        self.lock = threading.Lock()
+
+    def take(self):
+        '''
+        Everything recorded so far, leaving the collector empty.
+        '''
+        with self.lock:
+            taken = self.timings, self.counts, self.dimensions
+            self.timings, self.counts = {}, {}
+            self.dimensions = dict(self.dimensions)
+        return taken
+
+
+_process = _Collector({'Route': 'background'})
+_current = contextvars.ContextVar('metrics_collector', default=None)
+
+
+def _collector():
+    collector = _current.get()
+    return _process if collector is None else collector
+
+@contextmanager
+def scope(**dimensions):
+    '''
+    Collect everything recorded in the block, in this context and in
+    functions wrapped with bind(), and flush it when the block ends.
+    '''
+    collector = _Collector(dimensions)
+    token = _current.set(collector)
+    try:
+        yield collector
+    finally:
+        _current.reset(token)
+        _emit(*collector.take())
+        _emit(*_process.take())
+
+def bind(function):
+    '''
+    Wrap `function` so it records into the current scope when it runs on
+    another thread, e.g. an executor's.
+    '''
+    collector = _current.get()
+    if collector is None:
+        return function
+
+    def bound(*args, **kwargs):
+        token = _current.set(collector)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return bound
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, (time.perf_counter_ns() - self.start) / 1e6)
+        return False
+
+
+def timer(name):
+    '''
+    Context manager that records the time spent in its block, in ms.
+    '''
+    return _Timer(name)
+
+def record(name, milliseconds):
+    if not ENABLED:
+        return
+    collector = _collector()
+    values = collector.timings.get(name)
+    if values is None:
+        with collector.lock:
+            values = collector.timings.setdefault(name, [])
+    values.append(milliseconds)
+
+def count(name, value=1):
+    if not ENABLED:
+        return
+    collector = _collector()
+    with collector.lock:
+        collector.counts[name] = collector.counts.get(name, 0) + value
+
+def set_dimension(name, value):
+    collector = _collector()
+    with collector.lock:
+        collector.dimensions[name] = value
+
+def emf_stdout_sink(metrics):
+    sys.stdout.write(json.dumps(metrics) + '\n')
+
+_sink = emf_stdout_sink
+
+
+def set_sink(sink):
+    '''
+    Replace the output, e.g. with a function that collects the dicts in a
+    benchmark. The sink receives one EMF dict per flush.
+    '''
+    global _sink
+    _sink = sink
+
+def to_emf(timings, counts, dimensions):
+    emf_metrics = [{'Name': name, 'Unit': 'Milliseconds'} for name in timings]
+    emf_metrics += [{'Name': name, 'Unit': 'Count'} for name in counts]
+    document = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [list(dimensions)],
+                'Metrics': emf_metrics
+            }]
+        }
+    }
+    document.update(dimensions)
+    for name, values in timings.items():
+        document[name] = [round(v, 3) for v in values[:MAX_VALUES]]
+    document.update(counts)
+    return document
+
+def flush():
+    '''
+    Emit everything the current collector recorded since the last flush
+    and start over.
+    '''
+    _emit(*_collector().take())
+
+def _emit(timings, counts, dimensions):
+    if not ENABLED or not (timings or counts):
+        return
+    try:
+        _sink(to_emf(timings, counts, dimensions))
+    except Exception as e:
+        sys.stderr.write(f'Error emitting metrics: {e}\n')
@@ -0,0 +1,273 @@
+'''
+Normalization of spoken or transcribed numbers: phone numbers, PINs, zip
+codes and money amounts.
+
+Every function tokenizes its input once (plain words are split directly,
+anything else goes through a precompiled pattern) and walks the tokens in a
+single pass over module-level tables. Nothing is printed; the
+result is a Normalized value carrying an error message and a confidence score
+(the share of tokens that were recognized as part of the number).
+'''
+import re
+
+# Digit groups ("60,000", "1.5", "60k") or runs of letters.
+_TOKEN = re.compile(r"\d[\d,]*(?:\.\d+)?k?|[a-z]+")
+_LETTER = re.compile(r"[a-zA-Z]")
+_NON_DIGIT = re.compile(r"\D+")
+_DIGIT = re.compile(r"\d")
+# Letters right next to a digit, as in "A1B2" (or "one2three").
+_CODE_LETTERS = re.compile(r"[a-zA-Z]+(?=\d)|(?<=\d)[a-zA-Z]+")
+_SEPARATORS = re.compile(r"[\s(),-]+")
+
+UNIT, TEEN, TENS, HUNDRED, SCALE, REPEAT, POINT = range(7)
+
+DIGIT_WORDS = ('zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine')
+
+# token -> (kind, value)
+WORDS = {word: (UNIT, n) for n, word in enumerate(DIGIT_WORDS)}
+WORDS.update({'oh': (UNIT, 0), 'o': (UNIT, 0)})
+# Digit words only, for the common "one two three" input.
+SIMPLE_DIGITS = {word: str(value) for word, (kind, value) in WORDS.items()}
+_SIMPLE_DIGIT = SIMPLE_DIGITS.__getitem__
+WORDS.update({
+    word: (TEEN, n) for n, word in enumerate((
+        'ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen',
+        'sixteen', 'seventeen', 'eighteen', 'nineteen'), start=10)
+})
+WORDS.update({
+    word: (TENS, n) for n, word in zip(range(20, 100, 10), (
+        'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety'))
+})
+WORDS.update({
+    'hundred': (HUNDRED, 100),
+    'thousand': (SCALE, 1000),
+    'million': (SCALE, 1000000),
+    'billion': (SCALE, 1000000000),
+    'double': (REPEAT, 2),
+    'triple': (REPEAT, 3),
+    'point': (POINT, None),
+})
+# Number words that may touch a digit in a spoken PIN ("one2three"). A
+# lone "o" next to a digit is read as a letter.
+_NUMBER_WORDS = frozenset(WORDS) - {'o'}
+
+
+class Normalized:
+    '''
+    Result of a normalization. `value` is the best effort result, `error`
+    is None when the input was understood.
+    '''
+    __slots__ = ('value', 'error', 'confidence')
+
+    def __init__(self, value, error=None, confidence=1.0):
+        self.value = value
+        self.error = error
+        self.confidence = confidence
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return f"Normalized(value={self.value!r}, error={self.error!r}, confidence={self.confidence:.2f})"
+
+
+def _confidence(known, unknown):
+    total = known + unknown
+    return known / total if total else 0.0
+
+def _tokens(text):
+    '''
+    Lowercase tokens of `text`. Plain words separated by spaces, commas or
+    hyphens -- most transcripts -- are split without running the pattern.
+    '''
+    text = text.lower()
+    words = text.replace(',', ' ').replace('-', ' ')
+    if words.isascii() and words.replace(' ', '').isalpha():
+        return words.split()
+    return _TOKEN.findall(text)
+
+def normalize_digits(text):
+    '''
+    Turn a spoken digit sequence into a string of digits, e.g.
+    "five five five, double one oh two" -> "5551102". Tens and teens are
+    read the way people say them in numbers ("seventy two" -> "72",
+    "nineteen" -> "19"), and filler words are skipped.
+    '''
+    if isinstance(text, int):
+        return Normalized(str(text))
+    if not _LETTER.search(text):
+        digits = _NON_DIGIT.sub('', text)
+        return Normalized(digits, None if digits else 'No digits found', 1.0 if digits else 0.0)
+    tokens = _tokens(text)
+    try:
+        return Normalized(''.join(map(_SIMPLE_DIGIT, tokens)))
+    except KeyError:
+        pass
+    out = []
+    known = unknown = 0
+    repeat = 1
+    tens = None
+    after_hundred = False
+    for token in tokens:
+        if token[0].isdigit():
+            kind = None
+            value = token.replace(',', '').replace('.', '')
+            if value.endswith('k'):
+                value = value[:-1] + '000'
+        else:
+            kind, value = WORDS.get(token, (False, None))
+            if kind is False:
+                unknown += 1
+                continue
+        known += 1
+        if tens is not None:
+            tens_digit, tens = tens, None
+            if repeat == 1 and (
+                    (kind == UNIT and value) or (kind is None and len(value) == 1 and value != '0')):
+                out.append(f'{tens_digit}{value}')
+                continue
+            out.append(f'{tens_digit}0')
+        if after_hundred:
+            after_hundred = False
+            if kind == TEEN:
+                out.append(str(value))
+                continue
+            if kind == TENS:
+                tens = value // 10
+                continue
+            out.append('00')
+        if kind is None:
+            out.append(value * repeat)
+            repeat = 1
+        elif kind == UNIT or kind == TEEN:
+            out.append(str(value) * repeat)
+            repeat = 1
+        elif kind == TENS:
+            tens = value // 10
+            repeat = 1
+        elif kind == HUNDRED:
+            if not out:
+                out.append('1')
+            after_hundred = True
+        elif kind == SCALE:
+            out.append('0' * (len(str(value)) - 1))
+        elif kind == REPEAT:
+            repeat = value
+    if tens is not None:
+        out.append(f'{tens}0')
+    if after_hundred:
+        out.append('00')
+    digits = ''.join(out)
+    confidence = _confidence(known, unknown)
+    if repeat != 1:
+        return Normalized(digits, 'Repeat word without a digit after it', confidence)
+    if not digits:
+        return Normalized(digits, 'No digits found', confidence)
+    return Normalized(digits, None, confidence)
+
+def normalize_amount(text):
+    '''
+    Turn a spoken amount into an int, e.g. "one hundred and twenty five
+    thousand" -> 125000. Digit groups work too: "60 thousand", "$60,000",
+    "60k" and "1.5 million".
+    '''
+    if isinstance(text, (int, float)):
+        return Normalized(int(text))
+    total = 0
+    current = 0
+    fraction = None
+    known = unknown = 0
+    for token in _tokens(text):
+        kind, value = WORDS.get(token, (None, None))
+        if kind is None:
+            if token[0].isdigit():
+                value = token.replace(',', '')
+                scale = 1
+                if value.endswith('k'):
+                    value, scale = value[:-1], 1000
+                current += float(value) * scale
+                fraction = None
+                known += 1
+            else:
+                unknown += 1
+            continue
+        if kind == REPEAT:
+            unknown += 1
+            continue
+        known += 1
+        if fraction is not None and kind == UNIT:
+            fraction *= 10
+            current += value / fraction
+            continue
+        fraction = None
+        if kind < HUNDRED:
+            current += value
+        elif kind == HUNDRED:
+            current = (current or 1) * 100
+        elif kind == SCALE:
+            total += (current or 1) * value
+            current = 0
+        elif kind == POINT:
+            fraction = 1
+    confidence = _confidence(known, unknown)
+    if not known:
+        return Normalized(0, 'No number found', confidence)
+    amount = total + current
+    if isinstance(amount, float):
+        amount = int(round(amount, 6))
+    return Normalized(amount, None, confidence)
+
+def normalize_phone(phone):
+    '''
+    Normalize a US phone number to "+1XXXXXXXXXX". A leading country code
+    "1" is dropped before the length check.
+    '''
+    result = normalize_digits(phone)
+    digits = result.value
+    if len(digits) == 11 and digits.startswith('1'):
+        digits = digits[1:]
+    if not digits:
+        return Normalized(None, result.error, result.confidence)
+    if len(digits) != 10:
+        return Normalized('+1' + digits, f'Expected 10 digits, got {len(digits)}', result.confidence)
+    return Normalized('+1' + digits, result.error, result.confidence)
+
+def phone_key(phone):
+    '''
+    Normalized "+1XXXXXXXXXX" number, or None when the phone doesn't
+    normalize to ten digits. The one key a caller's phone is cached,
+    indexed and deduplicated under.
+    '''
+    if phone is None or phone == '':
+        return None
+    value = normalize_phone(phone).value
+    if value is None or len(value) != 12:
+        return None
+    return value
+
+def normalize_pin(pin):
+    '''
+    Normalize a spoken PIN like normalize_digits. An alphanumeric PIN,
+    where letters other than number words touch a digit ("A1B2", "x7 9k"),
+    is kept as it was given: its words that hold a digit, joined.
+    '''
+    if isinstance(pin, str) and _DIGIT.search(pin) and any(
+            letters.lower() not in _NUMBER_WORDS for letters in _CODE_LETTERS.findall(pin)):
+        return Normalized(''.join(word for word in _SEPARATORS.split(pin) if _DIGIT.search(word)))
+    return normalize_digits(pin)
+
+def normalize_zipcode(zip_code):
+    result = normalize_digits(zip_code)
+    if not result.value:
+        return Normalized(0, result.error, result.confidence)
+    return Normalized(int(result.value), result.error, result.confidence)
+
+def phone_words(phone):
+    '''
+    Spell a phone number out digit by digit, without the country code.
+    '''
+    digits = normalize_digits(phone).value
+    if len(digits) == 11 and digits.startswith('1'):
+        digits = digits[1:]
+    return ' '.join(DIGIT_WORDS[int(d)] for d in digits)
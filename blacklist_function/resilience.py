@@ -0,0 +1,148 @@
+'''
+Resilience helpers for upstream calls: deadlines derived from the Lambda
+context, a per-route circuit breaker and hedged requests for idempotent GETs.
+'''
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    '''
+    Raised instead of calling an upstream route whose breaker is open.
+    '''
+
+
+class CircuitBreaker:
+    '''
+    Trips open when the error rate over the last `window` seconds reaches
+    `error_rate` with at least `min_calls` calls. After `reset_timeout`
+    seconds one trial call is let through; its outcome closes the breaker
+    or opens it again.
+    '''
+    def __init__(self, name, error_rate=0.5, min_calls=5, window=30, reset_timeout=15):
+        self.name = name
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.opened_at = 0
+        self.rejected = 0
+        self.transitions = {}
+        self.listeners = []
+        self._outcomes = deque()
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        previous, self.state = self.state, state
+        key = f'{previous}->{state}'
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        for listener in self.listeners:
+            listener(self.name, previous, state)
+
+    def before_call(self):
+        '''
+        Raise CircuitOpenError if the call should not be made.
+        '''
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(f'Circuit for {self.name} is open')
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._trial_running:
+                    self.rejected += 1
+                    raise CircuitOpenError(f'Circuit for {self.name} is half open')
+                self._trial_running = True
+
+    def record(self, ok):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._trial_running = False
+                self._outcomes.clear()
+                self._transition(CLOSED if ok else OPEN)
+                return
+            outcomes = self._outcomes
+            outcomes.append((now, ok))
+            while outcomes and now - outcomes[0][0] > self.window:
+                outcomes.popleft()
+            if self.state == CLOSED and len(outcomes) >= self.min_calls:
+                failures = sum(1 for _, success in outcomes if not success)
+                if failures / len(outcomes) >= self.error_rate:
+                    outcomes.clear()
+                    self._transition(OPEN)
+
+    def metrics(self):
+        return {
+            'state': self.state,
+            'rejected': self.rejected,
+            'transitions': dict(self.transitions)
+        }
+
+
+def remaining_seconds(context, margin):
+    '''
+    Seconds left in this invocation minus `margin`, which is kept for
+    building the fallback response. None when there is no Lambda context.
+    '''
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
+    return context.get_remaining_time_in_millis() / 1000 - margin
+
+def deadline_timeout(timeout, remaining, floor=0.05):
+    '''
+    Shrink a (connect, read) timeout so it ends before the invocation does.
+    '''
+    if remaining is None:
+        return timeout
+    connect, read = timeout
+    budget = max(remaining, floor)
+    return (min(connect, budget), min(read, budget))
+
+
+_hedge_executor = None
+_hedge_lock = threading.Lock()
+
+
+def _get_hedge_executor(workers):
+    # Hedges get their own pool so that a handler already running on the
+    # shared executor never waits on a slot it is holding.
+    global _hedge_executor
+    with _hedge_lock:
+        if _hedge_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _hedge_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hedge')
+    return _hedge_executor
+
+def hedged_call(call, hedge_after, workers=8):
+    '''
+    Run `call`, starting one identical attempt if the first hasn't finished
+    after `hedge_after` seconds. Returns the first successful result, or
+    raises the last error if both attempts fail. Only for idempotent calls.
+    '''
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    executor = _get_hedge_executor(workers)
+    first = executor.submit(call)
+    done, _ = wait([first], timeout=hedge_after)
+    if done:
+        return first.result()
+    pending = {first, executor.submit(call)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
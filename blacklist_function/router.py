@@ -0,0 +1,69 @@
+'''
+Dict based request router with a middleware pipeline.
+
+Routes are registered per path and HTTP method, with ANY matching every
+method. A middleware takes the next handler and returns a handler with the
+same (event, context) signature, so each route's pipeline is composed once
+when it is added and a request costs one dict lookup plus its own pipeline.
+A coroutine handler gets a coroutine pipeline, so middleware used on async
+routes checks is_async(handler) and wraps it with a coroutine of its own.
+'''
+ANY = '*'
+# inspect.CO_COROUTINE, without importing inspect at cold start.
+CO_COROUTINE = 0x80
+
+
+def is_async(handler):
+    '''
+    Whether `handler` is a coroutine function (async def).
+    '''
+    code = getattr(handler, '__code__', None)
+    return code is not None and bool(code.co_flags & CO_COROUTINE)
+
+
+class HttpError(Exception):
+    '''
+    Raised by handlers and middleware to answer with a given status code.
+    '''
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Router:
+    def __init__(self, middleware=()):
+        self.middleware = list(middleware)
+        self.routes = {}
+        self.methods = {}
+
+    def add(self, path, handler, methods=(ANY,), middleware=()):
+        '''
+        Register `handler` for `path`. Router-wide middleware runs first,
+        then the route's own, in the order given.
+        '''
+        pipeline = handler
+        for wrap in reversed(self.middleware + list(middleware)):
+            pipeline = wrap(pipeline)
+        for method in methods:
+            method = method.upper()
+            self.routes[(method, path)] = pipeline
+            self.methods.setdefault(path, set()).add(method)
+        return pipeline
+
+    def resolve(self, method, path):
+        '''
+        Return the pipeline for this method and path, or None.
+        '''
+        return self.routes.get((method, path)) or self.routes.get((ANY, path))
+
+    def dispatch(self, method, path, event, context):
+        '''
+        Run the matching pipeline. Raises HttpError 404 for an unknown path
+        and 405 for a method that isn't registered on a known one.
+        '''
+        handler = self.resolve(method, path)
+        if handler is None:
+            if path in self.methods:
+                raise HttpError(405, f'Method {method} not allowed')
+            raise HttpError(404, 'Not found')
+        return handler(event, context)
@@ -0,0 +1,227 @@
+'''
+Call-flow state machine compiled from a Lucidchart diagram.
+
+diagram_converter.compile_call_flow() turns a diagram into an artifact the
+voice agent can route with instead of reading the markdown every turn:
+
+    {"format": "call-flow", "version": 1, "start": "<state id>",
+     "states": {"<id>": {"type": "process" | "terminator" | "decision",
+                         "title": ..., "jump": ..., "hidden": true,
+                         "content": ..., "questions": ["<decision id>", ...]}},
+     "transitions": {"<id>": {"yes": "<id>", "no": "<id>", "next": "<id>"}}}
+
+Empty fields are left out. A decision's title is its question; its "yes"
+and "no" transitions follow the diagram's arrows (other arrow labels are
+kept as answers of their own). A section's questions are the decisions it
+leads to and its "next" transition is a direct link to another section.
+
+The artifact is stored as JSON or in a compact binary form (see to_bytes).
+CallFlow loads either once and answers next(state, answer) with two dict
+lookups.
+'''
+import json
+import os
+import struct
+
+FORMAT = 'call-flow'
+VERSION = 1
+TYPES = ('process', 'terminator', 'decision')
+
+# Spoken or typed answers accepted for the diagram's arrow labels.
+ANSWER_ALIASES = {
+    'y': 'yes', 'yeah': 'yes', 'yep': 'yes', 'true': 'yes',
+    'n': 'no', 'nope': 'no', 'false': 'no',
+}
+
+# Binary layout, little endian, every section a flat array so loading
+# is a few bulk unpacks:
+#   header       magic, version, string count, state count, question count,
+#                transition count, start state index (-1 for none) and the
+#                byte length of the string data
+#   strings      the character length of each string, then all strings as
+#                one UTF-8 block
+#   states       per state: id, type, flags, title, jump, content (string
+#                indexes) and question count
+#   questions    the question state indexes of every state, in state order
+#   transitions  per transition: source state, answer string, target state
+MAGIC = b'CFSM'
+_HEADER = struct.Struct('<4sBIIIIiI')
+_STATE = struct.Struct('<IBBIIIH')
+_TRANSITION = struct.Struct('<III')
+_HIDDEN = 1
+
+
+class State:
+    __slots__ = ('id', 'type', 'title', 'jump', 'hidden', 'content', 'questions')
+
+    def __init__(self, id, type, title='', jump='', hidden=False, content='', questions=()):
+        self.id = id
+        self.type = type
+        self.title = title
+        self.jump = jump
+        self.hidden = hidden
+        self.content = content
+        self.questions = tuple(questions)
+
+    def __repr__(self):
+        return f"State(id={self.id}, type={self.type}, title={self.title!r})"
+
+
+def normalize_answer(answer):
+    if isinstance(answer, bool):
+        return 'yes' if answer else 'no'
+    answer = str(answer).strip().lower()
+    return ANSWER_ALIASES.get(answer, answer)
+
+
+class CallFlow:
+    '''
+    Loaded state machine. States and transitions are plain dicts keyed by
+    state id, so lookups don't depend on the size of the diagram.
+    '''
+    def __init__(self, artifact):
+        if artifact.get('format') != FORMAT or artifact.get('version') != VERSION:
+            raise ValueError('Not a call-flow artifact of version %s' % VERSION)
+        self.start = artifact.get('start')
+        self.states = {
+            state_id: State(
+                state_id, fields['type'], fields.get('title', ''), fields.get('jump', ''),
+                fields.get('hidden', False), fields.get('content', ''), fields.get('questions', ())
+            )
+            for state_id, fields in artifact['states'].items()
+        }
+        self.transitions = artifact.get('transitions', {})
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Load an artifact written by save(), in either form.
+        '''
+        with open(filename, 'rb') as f:
+            data = f.read()
+        if data.startswith(MAGIC):
+            return cls.from_bytes(data)
+        return cls(json.loads(data))
+
+    def state(self, state_id):
+        return self.states[state_id]
+
+    def answers(self, state_id):
+        '''
+        Answers with a transition out of `state_id`.
+        '''
+        return list(self.transitions.get(state_id, ()))
+
+    def next(self, state_id, answer='next'):
+        '''
+        State that `answer` leads to from `state_id`, or None when the
+        diagram has no such arrow. Raises KeyError for an unknown state.
+        '''
+        if state_id not in self.states:
+            raise KeyError(state_id)
+        transitions = self.transitions.get(state_id)
+        if transitions is None:
+            return None
+        target = transitions.get(normalize_answer(answer))
+        return None if target is None else self.states[target]
+
+    def to_artifact(self):
+        states = {}
+        for state_id, state in self.states.items():
+            fields = {'type': state.type}
+            for name in ('title', 'jump', 'hidden', 'content', 'questions'):
+                value = getattr(state, name)
+                if value:
+                    fields[name] = list(value) if name == 'questions' else value
+            states[state_id] = fields
+        return {'format': FORMAT, 'version': VERSION, 'start': self.start,
+                'states': states, 'transitions': self.transitions}
+
+    def to_json(self):
+        return json.dumps(self.to_artifact(), separators=(',', ':'), ensure_ascii=False)
+
+    def to_bytes(self):
+        strings = {}
+
+        def string(value):
+            index = strings.get(value)
+            if index is None:
+                index = strings[value] = len(strings)
+            return index
+
+        index = {state_id: position for position, state_id in enumerate(self.states)}
+        states = []
+        questions = []
+        for state in self.states.values():
+            states.append(_STATE.pack(
+                string(state.id), TYPES.index(state.type), _HIDDEN if state.hidden else 0,
+                string(state.title), string(state.jump), string(state.content), len(state.questions)
+            ))
+            questions.extend(index[question] for question in state.questions)
+        transitions = [
+            _TRANSITION.pack(index[source], string(answer), index[target])
+            for source, answers in self.transitions.items()
+            for answer, target in answers.items()
+        ]
+        text = ''.join(strings).encode()
+        return b''.join([
+            _HEADER.pack(MAGIC, VERSION, len(strings), len(states), len(questions), len(transitions),
+                         index.get(self.start, -1), len(text)),
+            struct.pack(f'<{len(strings)}I', *map(len, strings)),
+            text,
+            *states,
+            struct.pack(f'<{len(questions)}I', *questions),
+            *transitions
+        ])
+
+    @classmethod
+    def from_bytes(cls, data):
+        header = _HEADER.unpack_from(data)
+        magic, version, string_count, state_count, question_count, transition_count, start, text_size = header
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a call-flow artifact of version %s' % VERSION)
+        offset = _HEADER.size
+        lengths = struct.unpack_from(f'<{string_count}I', data, offset)
+        offset += 4 * string_count
+        text = data[offset:offset + text_size].decode()
+        offset += text_size
+        strings = []
+        position = 0
+        for length in lengths:
+            strings.append(text[position:position + length])
+            position += length
+        end = offset + _STATE.size * state_count
+        records = list(_STATE.iter_unpack(data[offset:end]))
+        offset = end
+        questions = struct.unpack_from(f'<{question_count}I', data, offset)
+        offset += 4 * question_count
+        end = offset + _TRANSITION.size * transition_count
+
+        ids = [strings[record[0]] for record in records]
+        flow = cls.__new__(cls)
+        flow.start = ids[start] if start >= 0 else None
+        flow.states = {}
+        position = 0
+        for state_id, (_, type_index, flags, title, jump, content, count) in zip(ids, records):
+            flow.states[state_id] = State(
+                state_id, TYPES[type_index], strings[title], strings[jump], bool(flags & _HIDDEN),
+                strings[content], [ids[question] for question in questions[position:position + count]]
+            )
+            position += count
+        flow.transitions = {}
+        for source, answer, target in _TRANSITION.iter_unpack(data[offset:end]):
+            transitions = flow.transitions.get(ids[source])
+            if transitions is None:
+                transitions = flow.transitions[ids[source]] = {}
+            transitions[strings[answer]] = ids[target]
+        return flow
+
+    def save(self, filename, binary=False):
+        '''
+        Write the artifact as JSON, or in the binary form. Like the markdown
+        output it goes to a temporary file first and is renamed into place.
+        '''
+        tmp_file = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(self.to_bytes() if binary else self.to_json().encode())
+        os.replace(tmp_file, filename)
@@ -1,84 +1,139 @@
+import hashlib
 import json
+import logging
+import os
 import re
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+# Comments by these authors are read as directives and section content;
+# anyone else's comments are review notes and are ignored. None accepts
+# every author. DIAGRAM_AUTHORS sets the default as a comma separated list.
+DEFAULT_AUTHORS = tuple(
+    author.strip() for author in os.getenv('DIAGRAM_AUTHORS', 'Jeremy Villalobos').split(',')
+    if author.strip()
+) or None
+
+
+class Directives:
+    '''
+    What a node's comments say about it:
+
+        hide:   leave the node out of the output
+        jump:   the phrase to say when jumping to the node's section
+        title:  section title to use instead of the shape text
+        note:   internal note, kept in `notes` and not rendered
+
+    Any other comment line is section content.
+    '''
+    __slots__ = ('hide', 'jump', 'title', 'notes', 'content')
+
+    def __init__(self):
+        self.hide = False
+        self.jump = ""
+        self.title = None
+        self.notes = []
+        self.content = []
+
+
+def _hide(directives, value, thread):
+    directives.hide = True
+
+def _jump(directives, value, thread):
+    # The first jump of a comment thread counts; a later thread overrides it.
+    if thread.get('jump') is None:
+        thread['jump'] = directives.jump = value
+
+def _title(directives, value, thread):
+    directives.title = value
+
+def _note(directives, value, thread):
+    directives.notes.append(value)
+
+# Directive name -> function(directives, value, thread). Register new
+# directive types here.
+DIRECTIVES = {
+    'hide': _hide,
+    'jump': _jump,
+    'title': _title,
+    'note': _note,
+}
+
+
+def parse_directives(comment, authors=DEFAULT_AUTHORS):
+    '''
+    Parse a Lucidchart "Comments" JSON value into Directives.
+    '''
+    directives = Directives()
+    if not comment:
+        return directives
+    try:
+        threads = json.loads(comment)
+    except ValueError:
+        logger.warning("Error parsing comment JSON: %r", comment)
+        return directives
+    for thread in threads:
+        seen = {}
+        for item in thread.get("Comments", []):
+            if authors is not None and item.get("Creator") not in authors:
+                continue
+            content = item.get("Content", "").strip()
+            if not content:
+                continue
+            name, colon, value = content.partition(":")
+            directive = DIRECTIVES.get(name) if colon else None
+            if directive is None:
+                directives.content.append(content)
+            else:
+                directive(directives, value.strip(), seen)
+    return directives
 
 
 class Node:
-    def __init__(self, shape):  
-        self.id = shape['id']
-        self.text = shape['text']
-        if not shape['comment']:
-            self.comment = []
-        else:
-            self.comment = json.loads(shape['comment'])
-        self.type = shape['type']
+    __slots__ = ('id', 'text', 'directives', 'type', 'connections')
+
+    def __init__(self, id, text, type, comment='', authors=DEFAULT_AUTHORS):
+        self.id = id
+        self.text = text
+        self.directives = parse_directives(comment, authors)
+        self.type = type
         self.connections = []
+
+    @classmethod
+    def from_shape(cls, shape, authors=DEFAULT_AUTHORS):
+        return cls(shape['id'], shape['text'], shape['type'], shape['comment'], authors)
+
+    @property
+    def title(self):
+        if self.directives.title:
+            return self.directives.title
+        return self.text
+
     def hide( self ):
         '''
-        Hide the comment if it contains the word "hide"
+        Whether a "hide:" comment takes the node out of the output
         '''
-        if not self.comment:
-            return False
-        try:
-            for comment_obj in self.comment:
-                print( "comment_obj: ", comment_obj )
-                for comment in comment_obj.get("Comments", []):
-                    if comment.get("Creator") == "Jeremy Villalobos":
-                        content = comment.get("Content", "").strip()
-                        if content.startswith("hide:"):
-                            return True
-            return False
-        except json.JSONDecodeError:
-            print( "Error parsing comment JSON" , self.comment )
-            return False
+        return self.directives.hide
+
     def jump( self ):
         """
         Get the jump phrase from the comment
         """
-        try:
-            comments_array = self.comment
-            jump = ""
-            for comment_obj in comments_array:
-                for comment in comment_obj.get("Comments", []):
-                    if comment.get("Creator") == "Jeremy Villalobos":
-                        content = comment.get("Content", "").strip()
-                        if content.startswith("jump:"):
-                            jump = content.split("jump:")[1].strip()
-                            break
-            return jump
-            
-        except json.JSONDecodeError:
-            import traceback
-            print(f"Error parsing comment JSON: {traceback.format_exc()}")
-            return ""
-        
+        return self.directives.jump
+
     def process_comment(self):
         """
-        Process the comment to remove the first line and the last line
-        """
+        Section content: the author's comments that aren't directives
         """
-        Process the comment to extract content from Jeremy's comments
-        """
-        
-        if not self.comment:
-            return ""
-            
-        try:
-            jeremy_comments = []
-            for comment_obj in self.comment:
-                for comment in comment_obj.get("Comments", []):
-                    if comment.get("Creator") == "Jeremy Villalobos":
-                        content = comment.get("Content", "").strip()
-                        if content and not content.startswith("jump:"):
-                            jeremy_comments.append(content)
-            return "\n".join(jeremy_comments)
-            
-        except json.JSONDecodeError:
-            import traceback
-            print(f"Error parsing comment JSON: {traceback.format_exc()}")
-            return ""
+        return "\n".join(self.directives.content)
 
 
 class Connection:
+    __slots__ = ('source', 'target', 'arrow_text')
+
     def __init__(self, source, target, arrow_text):
         self.source = source
         self.target = target
@@ -86,135 +141,516 @@ class Connection:
     def __repr__(self):
         return f"Connection(source={self.source}, target={self.target}, arrow_text={self.arrow_text})"
 
-def convert_lucid_diagram_to_md(diagram_json):
-    """
-    Convert a LucidChart decision tree diagram to markdown format
-    """
-    output = []
-    
-    # Parse the diagram JSON
-    diagram = diagram_json
-    from pprint import pprint
-    pprint(  diagram )
-    # Dictionary to store node connections
+class Diagram:
     '''
-    Connection is a dictionary of source_id to list of target_ids
-    like:
-    {
-        "1": [
-            {
-                "target": "2",
-                "arrow_text": "Yes"
-            },
-            {
-                "target": "3",
-                "arrow_text": "No"
-            }
-        ],
-    }
+    Node and edge store. `nodes` maps id to Node in file order and
+    `connections` maps a source id to its outgoing Connections, like:
+
+        {"1": [Connection(source="1", target="2", arrow_text="Yes"),
+               Connection(source="1", target="3", arrow_text="No")]}
     '''
-    connections = {}
-    from pprint import pprint
-    # First pass - build connections map
-    nodes = {}
-    for shape in diagram['shapes']:
-        if shape['type'] == 'connector':
-            source = shape['source']
-            target = shape['target'] 
-            if source not in connections:
-                connections[source] = []
-            connections[source].append(Connection(source, target, shape['arrow_text']))
-        else:
-            nodes[shape['id']] = Node(shape)
-    print(f"connections:")
-    pprint(connections)
-    # Second pass - generate markdown
-    
-    for node_id, node in nodes.items():
-        if node.type in ['process', 'terminator']:
-            process_title = node.text.strip()
-            process_content = node.process_comment( )
-            
-            if node.hide():
-                print(f"Hiding {node.id}")
-                continue
+    __slots__ = ('nodes', 'connections')
 
-            print( "Node: ", process_title )
-            # Get connected decisions
-            decisions = []
-            goto = None
-
-            if node.id in connections:
-                target_queue = [ (c,1) for c in connections[node.id]]
-                while target_queue:
-                    connection_info, level = target_queue.pop(0) 
-                    target = nodes[connection_info.target]
-                    if target.hide():
-                        print(f"Hiding {target.id}")
-                        continue
+    def __init__(self):
+        self.nodes = {}
+        self.connections = {}
+
+    def add_node(self, node):
+        self.nodes[node.id] = node
+
+    def add_connection(self, source, target, arrow_text):
+        connections = self.connections.get(source)
+        if connections is None:
+            connections = self.connections[source] = []
+        connections.append(Connection(source, target, arrow_text))
+
+    @classmethod
+    def from_shapes(cls, diagram_json, authors=DEFAULT_AUTHORS):
+        '''
+        Build the store from a {'shapes': [...]} dict as returned by
+        read_diagram_file.
+        '''
+        diagram = cls()
+        for shape in diagram_json['shapes']:
+            if shape['type'] == 'connector':
+                diagram.add_connection(shape['source'], shape['target'], shape['arrow_text'])
+            else:
+                diagram.add_node(Node.from_shape(shape, authors))
+        return diagram
+
+class FlowGraph:
+    '''
+    Decision structure of a Diagram, worked out once and shared by every
+    section that reaches it.
+
+    A decision expands to its goto lines: the "Yes" (or unlabeled) edges,
+    and the "No" edges that lead to something other than a decision. Its
+    "No" edges to further decisions are its children, which are expanded
+    after it, breadth first. Which targets and children each decision has
+    is worked out once; the lines themselves are formatted as sections are
+    walked, so the graph doesn't hold a copy of the output.
+
+    Problems are collected instead of raised:
+        dangling   (source, target) of edges to shapes that don't exist
+        dead_ends  decisions without outgoing edges
+        cycles     decision ids that "No" edges lead around in a loop; the
+                   edge closing each loop is not followed
+
+    `style` names the STYLES entry that formats the goto lines.
+    '''
+    def __init__(self, diagram, style='full'):
+        self.nodes = diagram.nodes
+        self.connections = diagram.connections
+        self.style = style
+        self.goto_line, self.section_goto_line = STYLES[style]
+        self.dangling = []
+        self.dead_ends = []
+        self.cycles = []
+        self._expansions = {}
+        self._digests = {}
+        for source, connections in self.connections.items():
+            for connection in connections:
+                if connection.target not in self.nodes:
+                    self.dangling.append((source, connection.target))
+        self._break_cycles()
+
+    def _structure(self, decision_id):
+        '''
+        (targets, children) of a decision, where targets holds a
+        (negated, target node) pair per goto line. Memoized.
+        '''
+        structure = self._expansions.get(decision_id)
+        if structure is not None:
+            return structure
+        targets = []
+        children = []
+        decision = self.nodes[decision_id]
+        decision_text = decision.text.strip()
+        outgoing = self.connections.get(decision_id)
+        if outgoing is None:
+            self.dead_ends.append(decision_id)
+        elif decision_text and not decision.hide():
+            for connector in outgoing:
+                target = self.nodes.get(connector.target)
+                if target is None:
+                    continue
+                if connector.arrow_text.strip() == "No":
                     if target.type == 'decision':
-                        '''
-                        If the target is a decision, we iterate over the NO path.  And the yes 
-                        path is added to the decision list.
-                        '''
-                        target_connectors = connections[connection_info.target]
-                        decision_text = target.text.strip()
-                        for decision_connector in target_connectors:
-                            arrow_text = decision_connector.arrow_text.strip() if decision_connector else ''
-                            if decision_text:
-                                if arrow_text == "No":
-                                    # Get the target that this "No" path points to
-                                    target_target =nodes[decision_connector.target]
-                                    if target_target.type == 'decision':
-                                        target_queue.append( (decision_connector, level ) )
-                                    else:
-                                        decisions.append(
-                                            "".join([
-                                                "\t" * level , 
-                                                f"- {add_not(decision_text)}?", 
-                                                " goto ",
-                                                target_target.text , 
-                                                f" section. say: \"{target_target.jump()}\""
-                                            ])
-                                        )
-                                else:
-                                    target_target = nodes[decision_connector.target]
-                                    decisions.append(
-                                        "".join([
-
-                                            "\t" * level , f"- {decision_text}?", " goto ",
-                                            target_target.text , f" section. say: \"{target_target.jump()}\""
-                                        ])
-                                    )
-                    if target.type == 'process' and not target.type == 'terminator':
-                        '''
-                        If the process is targeting a process, then we simply add the jump 
-                        to the decision list. 
-                        We don't follow connection from the terminator since these are not 
-                        executable.
-                        '''
-                        goto="".join([
-                                "- goto ",
-                                target.text , f" section. say: {target.jump()}"
-                            ])
-                        
-            
-            # Generate markdown section
-            if process_title:
-                output.append(f"\n## {process_title}")
-                if process_content:
-                    output.append(f"\n{process_content}")
-                    
-                if goto:
-                    output.append(goto)
-                if decisions:
-                    output.append("\n- Key questions:")
-                    for decision in decisions:
-                        if decision:
-                            output.append(f"{decision}")
-                            
+                        children.append(target.id)
+                    else:
+                        targets.append((True, target))
+                else:
+                    targets.append((False, target))
+        structure = self._expansions[decision_id] = (targets, children)
+        return structure
+
+    def expansion(self, decision_id):
+        '''
+        (lines, children) of a decision.
+        '''
+        targets, children = self._structure(decision_id)
+        if not targets:
+            return [], children
+        decision_text = self.nodes[decision_id].text.strip()
+        negated = add_not(decision_text) if any(is_negated for is_negated, _ in targets) else None
+        return [
+            self.goto_line(negated if is_negated else decision_text, target)
+            for is_negated, target in targets
+        ], children
+
+    def _break_cycles(self):
+        # Iterative depth-first search over the "No" edges between
+        # decisions; an edge back to a decision on the current path closes
+        # a cycle and is dropped.
+        on_path = set()
+        done = set()
+        for start, node in self.nodes.items():
+            if node.type != 'decision' or start in done:
+                continue
+            path = [start]
+            on_path.add(start)
+            stack = [iter(list(self._structure(start)[1]))]
+            while stack:
+                for child in stack[-1]:
+                    if child in on_path:
+                        self.cycles.append(path[path.index(child):])
+                        self._structure(path[-1])[1].remove(child)
+                    elif child not in done:
+                        path.append(child)
+                        on_path.add(child)
+                        stack.append(iter(list(self._structure(child)[1])))
+                        break
+                else:
+                    stack.pop()
+                    finished = path.pop()
+                    on_path.discard(finished)
+                    done.add(finished)
+
+    def section_start(self, node_id):
+        '''
+        (goto, decision ids) reached directly from a process or terminator.
+        '''
+        goto = None
+        decision_ids = []
+        for connection in self.connections.get(node_id, ()):
+            target = self.nodes.get(connection.target)
+            if target is None:
+                continue
+            if target.hide():
+                logger.debug("Hiding %s", target.id)
+                continue
+            if target.type == 'decision':
+                decision_ids.append(target.id)
+            elif target.type == 'process':
+                # A process pointing at a process jumps straight to it. We
+                # don't follow terminators since these are not executable.
+                goto = self.section_goto_line(target)
+        return goto, decision_ids
+
+    def walk(self, decision_ids):
+        '''
+        Goto lines of the given decisions and the decisions after them,
+        breadth first.
+        '''
+        queue = deque(decision_ids)
+        decisions = []
+        while queue:
+            lines, children = self.expansion(queue.popleft())
+            decisions.extend(lines)
+            queue.extend(children)
+        return decisions
+
+    def section(self, node_id):
+        '''
+        (goto, decision lines) for a process or terminator node.
+        '''
+        goto, decision_ids = self.section_start(node_id)
+        return goto, self.walk(decision_ids)
+
+    def decision_digest(self, decision_id):
+        '''
+        Hash of everything a decision's expansion depends on: its lines,
+        which carry its text and its targets' titles and jump phrases, and
+        the digests of its children.
+        '''
+        stack = [decision_id]
+        while stack:
+            current = stack[-1]
+            if current in self._digests:
+                stack.pop()
+                continue
+            lines, children = self.expansion(current)
+            pending = [child for child in children if child not in self._digests]
+            if pending:
+                stack.extend(pending)
+                continue
+            digest = hashlib.sha1()
+            for line in lines:
+                digest.update(line.encode())
+                digest.update(b'\n')
+            for child in children:
+                digest.update(self._digests[child].encode())
+            self._digests[current] = digest.hexdigest()
+            stack.pop()
+        return self._digests[decision_id]
+
+    def section_digest(self, node):
+        '''
+        Hash of everything render_section(node, self) depends on.
+        '''
+        goto, decision_ids = self.section_start(node.id)
+        digest = hashlib.sha1(repr((
+            node.type, node.hide(), node.title, node.process_comment(), goto
+        )).encode())
+        for decision_id in decision_ids:
+            digest.update(self.decision_digest(decision_id).encode())
+        return digest.hexdigest()
+
+    def log_problems(self):
+        for source, target in self.dangling:
+            logger.warning("Edge from %s points to missing shape %s", source, target)
+        for decision_id in self.dead_ends:
+            logger.warning("Decision %s has no outgoing edges", decision_id)
+        for cycle in self.cycles:
+            logger.warning("Decisions form a cycle: %s", " -> ".join(cycle + cycle[:1]))
+
+
+def goto_line(decision_text, target):
+    return "".join([
+        "\t", f"- {decision_text}?", " goto ",
+        target.title, f" section. say: \"{target.jump()}\""
+    ])
+
+def section_goto_line(target):
+    return "".join([
+        "- goto ",
+        target.title, f" section. say: {target.jump()}"
+    ])
+
+def short_goto_line(decision_text, target):
+    jump = target.jump()
+    return f"\t- {decision_text}? -> {target.title}" + (f' say "{jump}"' if jump else "")
+
+def short_section_goto_line(target):
+    jump = target.jump()
+    return f"- -> {target.title}" + (f' say "{jump}"' if jump else "")
+
+def compact_goto_line(decision_text, target):
+    if not has_section(target):
+        return short_goto_line(decision_text, target)
+    return f"\t- {decision_text}? -> {target.title}"
+
+def compact_section_goto_line(target):
+    if not has_section(target):
+        return short_section_goto_line(target)
+    return f"- -> {target.title}"
+
+# Markdown style -> (goto line for a decision, goto line for a direct link
+# between sections). "short" drops the repeated "goto ... section." wording;
+# "compact" also leaves out the jump phrase when the target has a section,
+# since render_section writes it once under that section's heading.
+# Targets without a section of their own (hidden, untitled or decisions)
+# keep it inline. LEGENDS explains each style's notation.
+STYLES = {
+    'full': (goto_line, section_goto_line),
+    'short': (short_goto_line, short_section_goto_line),
+    'compact': (compact_goto_line, compact_section_goto_line),
+}
+SHORT_LEGEND = '"- If X? -> S" means: if X, go to section S and say the phrase given after it.'
+COMPACT_LEGEND = (
+    '"- If X? -> S" means: if X, go to section S and say the phrase given after it or on the '
+    '"say:" line under "## S". "Key questions: Q1" means: also ask the questions under "## Q1".'
+)
+LEGENDS = {'short': SHORT_LEGEND, 'compact': COMPACT_LEGEND}
+
+
+def has_section(node):
+    """
+    Whether render_section writes a section for `node`.
+    """
+    return node.type in ('process', 'terminator') and not node.hide() and bool(node.title.strip())
+
+def render_section(node, graph, shared=None):
+    """
+    Markdown for one process or terminator node, or "" if it has none.
+    Decisions found in `shared` (decision id -> shared block name) are
+    referenced by name instead of being written out.
+    """
+    if node.type not in ('process', 'terminator'):
+        return ""
+    if node.hide():
+        logger.debug("Hiding %s", node.id)
+        return ""
+    process_title = node.title.strip()
+    if not process_title:
+        return ""
+    logger.debug("Node: %s", process_title)
+    output = [f"\n## {process_title}"]
+    if graph.style == 'compact' and node.jump():
+        output.append(f'say: "{node.jump()}"')
+    process_content = node.process_comment( )
+    if process_content:
+        output.append(f"\n{process_content}")
+    goto, decision_ids = graph.section_start(node.id)
+    references = []
+    if shared:
+        references = list(dict.fromkeys(shared[d] for d in decision_ids if d in shared))
+        decision_ids = [d for d in decision_ids if d not in shared]
+    decisions = graph.walk(decision_ids)
+    if goto:
+        output.append(goto)
+    if references:
+        output.append("\n- Key questions: " + ", ".join(references))
+    elif decisions:
+        output.append("\n- Key questions:")
+    for decision in decisions:
+        if decision:
+            output.append(f"{decision}")
     return '\n'.join(output)
 
+def count_tokens(text):
+    """
+    Token count of `text`: exact with tiktoken installed, otherwise the
+    usual estimate of one token per four characters.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+_encoding = None
+
+
+def shared_blocks(diagram, graph):
+    """
+    Decision id -> block name ("Q1", "Q2", ...) for every decision that
+    more than one rendered section starts from.
+    """
+    users = {}
+    for node_id, node in diagram.nodes.items():
+        if has_section(node):
+            for decision_id in set(graph.section_start(node_id)[1]):
+                users[decision_id] = users.get(decision_id, 0) + 1
+    shared = [decision_id for decision_id, count in users.items() if count > 1]
+    return {decision_id: f"Q{number}" for number, decision_id in enumerate(shared, 1)}
+
+def iter_blocks(diagram, style='full'):
+    """
+    Yield (title, text, style, node) for each block of markdown as it is
+    rendered: the legend of the short and compact styles, each section
+    (with its node) and the compact style's shared question blocks.
+    """
+    graph = FlowGraph(diagram, style)
+    graph.log_problems()
+    shared = shared_blocks(diagram, graph) if style == 'compact' else {}
+    if style != 'full':
+        yield '(legend)', LEGENDS[style], style, None
+    for node in diagram.nodes.values():
+        text = render_section(node, graph, shared)
+        if text:
+            yield node.title.strip(), text, style, node
+    for decision_id, name in shared.items():
+        lines = graph.walk([decision_id])
+        if lines:
+            yield name, '\n'.join([f"\n## {name}"] + lines), 'shared', None
+
+def iter_sections(diagram, style='full', authors=DEFAULT_AUTHORS):
+    """
+    Yield the markdown of each section lazily, in output order; joined
+    with newlines they make convert_lucid_diagram_to_md's document.
+    `diagram` is a Diagram or a {'shapes': [...]} dict.
+    """
+    if not isinstance(diagram, Diagram):
+        diagram = Diagram.from_shapes(diagram, authors)
+    for _, text, _, _ in iter_blocks(diagram, style):
+        yield text
+
+def _measure_blocks(blocks):
+    """
+    (entries, report, total tokens) of iter_blocks() output.
+    """
+    entries = [list(block) for block in blocks]
+    report = [{'section': title, 'tokens': count_tokens(text), 'style': kind}
+              for title, text, kind, _ in entries]
+    return entries, report, sum(entry['tokens'] for entry in report)
+
+def render_markdown(diagram, style='full', budget=None, over_budget='warn'):
+    """
+    Markdown for a Diagram and a report of its size: a list of
+    {'section', 'tokens', 'style'} entries in output order.
+
+    The 'short' style writes shorter goto lines, explained once by a
+    legend. The 'compact' style also says each jump phrase once under its section's heading rather
+    than on every line leading there, and writes decisions that several
+    sections start from once, as shared "## Q<n>" blocks that those
+    sections reference.
+
+    With a token `budget`, output over it is logged with its largest
+    sections ('warn'), or ('compact') the largest sections are rewritten
+    with short goto lines one at a time until it fits, falling back to the
+    compact style if that is not enough. The smallest of these renderings
+    is kept, so a legend is only added when it saves more than it costs.
+    """
+    entries, report, total = _measure_blocks(iter_blocks(diagram, style))
+
+    if budget is not None and total > budget and over_budget == 'compact' and style == 'full':
+        short_graph = FlowGraph(diagram, 'short')
+        short_entries, short_report, short_total = _measure_blocks(
+            [('(legend)', SHORT_LEGEND, 'short', None)] + entries)
+        for index in sorted(range(1, len(short_entries)), key=lambda i: -short_report[i]['tokens']):
+            text = render_section(short_entries[index][3], short_graph)
+            tokens = count_tokens(text)
+            short_total += tokens - short_report[index]['tokens']
+            short_entries[index][1:3] = [text, 'short']
+            short_report[index].update(tokens=tokens, style='short')
+            if short_total <= budget:
+                break
+        candidates = [(total, entries, report), (short_total, short_entries, short_report)]
+        if short_total > budget:
+            # Every section is short and it still doesn't fit; sharing
+            # decision blocks is the last thing left to try.
+            compact_entries, compact_report, compact_total = _measure_blocks(iter_blocks(diagram, 'compact'))
+            candidates.append((compact_total, compact_entries, compact_report))
+        # The legend only pays for itself once enough sections are
+        # shortened; keep whichever rendering is smallest, the full one on
+        # a tie.
+        total, entries, report = min(candidates, key=lambda candidate: candidate[0])
+
+    if budget is not None and total > budget:
+        largest = sorted(report, key=lambda entry: -entry['tokens'])[:5]
+        logger.warning("Markdown is %d tokens, over the budget of %d; largest sections: %s",
+                       total, budget, ", ".join(f"{e['section']} ({e['tokens']})" for e in largest))
+    return '\n'.join(entry[1] for entry in entries), report
+
+def convert_lucid_diagram_to_md(diagram, authors=DEFAULT_AUTHORS, style='full', budget=None,
+                                over_budget='warn'):
+    """
+    Convert a LucidChart decision tree diagram to markdown format.
+    `diagram` is a Diagram or a {'shapes': [...]} dict; `authors` only
+    applies to the latter. See render_markdown for the other arguments.
+    """
+    if not isinstance(diagram, Diagram):
+        diagram = Diagram.from_shapes(diagram, authors)
+    if budget is None:
+        return '\n'.join(iter_sections(diagram, style))
+    return render_markdown(diagram, style, budget, over_budget)[0]
+
+def compile_call_flow(diagram, authors=DEFAULT_AUTHORS):
+    """
+    Compile a diagram to a call_flow.CallFlow state machine that routes
+    the same way the markdown reads: a section's questions are the visible
+    decisions it points at, and a hidden or untitled decision has no
+    transitions. `diagram` is a Diagram or a {'shapes': [...]} dict.
+    """
+    from call_flow import FORMAT, VERSION, CallFlow
+
+    if not isinstance(diagram, Diagram):
+        diagram = Diagram.from_shapes(diagram, authors)
+    graph = FlowGraph(diagram)
+    graph.log_problems()
+    states = {}
+    transitions = {}
+    start = None
+    for node_id, node in diagram.nodes.items():
+        state = {'type': node.type, 'title': node.title.strip(), 'jump': node.jump(), 'hidden': node.hide()}
+        answers = {}
+        if node.type == 'decision':
+            if node.text.strip() and not node.hide():
+                for connection in diagram.connections.get(node_id, ()):
+                    if connection.target not in diagram.nodes:
+                        continue
+                    label = connection.arrow_text.strip()
+                    answer = 'no' if label == 'No' else label.lower() or 'yes'
+                    if answer in answers:
+                        logger.warning("Decision %s has more than one %r arrow; using the first", node_id, answer)
+                        continue
+                    answers[answer] = connection.target
+        else:
+            state['content'] = node.process_comment()
+            questions = []
+            for connection in diagram.connections.get(node_id, ()):
+                target = diagram.nodes.get(connection.target)
+                if target is None or target.hide():
+                    continue
+                if target.type == 'decision':
+                    questions.append(target.id)
+                elif target.type == 'process':
+                    answers['next'] = target.id
+            state['questions'] = questions
+            if start is None and state['title'] and not node.hide():
+                start = node_id
+        states[node_id] = state
+        if answers:
+            transitions[node_id] = answers
+    return CallFlow({'format': FORMAT, 'version': VERSION, 'start': start,
+                     'states': states, 'transitions': transitions})
+
 def add_not(decision_text):
     '''
     Add "not" to the decision text if it is not already there.
@@ -227,67 +663,416 @@ def add_not(decision_text):
     else:
         return decision_text
 
-def read_diagram_file(filename):
-    """
-    Read diagram JSON from file
-    """
+def shape_type(name):
+    '''
+    Shape type for a Lucidchart "Name" column, or None for shapes that are
+    not part of the flow.
+    '''
+    if 'Terminator' in name:
+        return 'terminator'
+    elif 'Decision' in name:
+        return 'decision'
+    elif 'Process' in name:
+        return 'process'
+    elif 'Page' in name:
+        return None
+    elif 'Line' in name:
+        return 'connector'
+    elif 'Document' in name:
+        return None
+    elif 'Text' in name:
+        return None
+    else:
+        raise ValueError(f"Unknown shape type: {name}")
+
+def iter_shape_rows(filename):
     """
-    Read diagram JSON from file and convert to expected format
+    Yield (type, id, text, comments, source, target) for every flow shape in
+    a Lucidchart CSV export, one row at a time.
     """
     import csv
-    import json
 
-    shapes = []
-    with open(filename) as f:
-        reader = csv.DictReader(f, delimiter=',')
-        
+    with open(filename, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = {name: index for index, name in enumerate(header)}
+        id_column = columns['Id']
+        name_column = columns['Name']
+        text_column = columns['Text Area 1']
+        comments_column = columns['Comments']
+        source_column = columns['Line Source']
+        target_column = columns['Line Destination']
         for row in reader:
-            shape = {
-                'id': row['Id'],
-                'text': row['Text Area 1'],
-                'comment': row['Comments'] or '',
-            }
-            
-            # Determine shape type based on Shape Library
-            if 'Terminator' in row['Name']:
-                shape['type'] = 'terminator'
-            elif 'Decision' in row['Name']:
-                shape['type'] = 'decision'
-            elif 'Process' in row['Name']:
-                shape['type'] = 'process'
-            elif 'Page' in row['Name']:
+            kind = shape_type(row[name_column])
+            if kind is None:
                 continue
-            elif 'Line' in row['Name']:
-                shape['type'] = 'connector'
-                shape['arrow_text'] = row['Text Area 1']
-                shape['source'] = row['Line Source']
-                shape['target'] = row['Line Destination']
-            elif 'Document' in row['Name']:
-                continue
-            elif 'Text' in row['Name']:
-                continue
-            else:
-                raise ValueError(f"Unknown shape type: {row['Name']}")
-            
-            shapes.append(shape)
+            yield (
+                kind,
+                row[id_column],
+                row[text_column],
+                row[comments_column],
+                row[source_column],
+                row[target_column]
+            )
+
+def read_diagram(filename, authors=DEFAULT_AUTHORS):
+    """
+    Read a Lucidchart CSV export straight into a Diagram. Comments by
+    `authors` are parsed into each node's directives.
+    """
+    diagram = Diagram()
+    for kind, id, text, comments, source, target in iter_shape_rows(filename):
+        if kind == 'connector':
+            diagram.add_connection(source, target, text)
+        else:
+            diagram.add_node(Node(id, text, kind, comments, authors))
+    return diagram
+
+def read_diagram_file(filename):
+    """
+    Read a Lucidchart CSV export as a {'shapes': [...]} dict.
+    """
+    shapes = []
+    for kind, id, text, comments, source, target in iter_shape_rows(filename):
+        shape = {
+            'id': id,
+            'text': text,
+            'comment': comments or '',
+            'type': kind
+        }
+        if kind == 'connector':
+            shape['arrow_text'] = text
+            shape['source'] = source
+            shape['target'] = target
+        shapes.append(shape)
     return {'shapes': shapes}
 
+# Characters collected from a section iterator before each write.
+WRITE_BUFFER_SIZE = 1 << 16
+
+
+def _write_buffered(sections, writer, buffer_size):
+    pending = []
+    pending_size = 0
+    written = 0
+    separator = ""
+    for section in sections:
+        pending.append(separator)
+        pending.append(section)
+        pending_size += len(separator) + len(section)
+        separator = "\n"
+        if pending_size >= buffer_size:
+            writer.write("".join(pending))
+            written += pending_size
+            pending = []
+            pending_size = 0
+    if pending:
+        writer.write("".join(pending))
+        written += pending_size
+    return written
+
+def write_sections(sections, output, buffer_size=WRITE_BUFFER_SIZE):
+    """
+    Write markdown sections, joined by newlines, as they come from an
+    iterator. `output` is a file name, "-" for stdout, or anything with a
+    write() method; writes are batched to about `buffer_size` characters.
+    A file is written to a temporary file next to it first, so readers
+    never see a half written file. Returns the number of characters
+    written.
+    """
+    if hasattr(output, 'write'):
+        return _write_buffered(sections, output, buffer_size)
+    if output == '-':
+        import sys
+
+        written = _write_buffered(sections, sys.stdout, buffer_size)
+        sys.stdout.flush()
+        return written
+    tmp_file = f'{output}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_file, 'w') as f:
+            written = _write_buffered(sections, f, buffer_size)
+        os.replace(tmp_file, output)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return written
+
 def write_markdown_file(filename, content):
     """
-    Write markdown content to file
+    Write markdown content to file, atomically like write_sections
+    """
+    write_sections([content], filename)
+
+# Output formats and the extension batch mode gives each: prose markdown,
+# or the call-flow state machine as JSON or in its binary form.
+OUTPUT_FORMATS = {'markdown': '.md', 'json': '.flow.json', 'binary': '.flow.bin'}
+
+
+def convert_diagram(input_file, output_file, authors=DEFAULT_AUTHORS, output_format='markdown',
+                    style='full', budget=None, over_budget='warn'):
+    """
+    Convert diagram file to markdown file, or to a call-flow state machine
+    for the 'json' and 'binary' formats. Markdown is written section by
+    section as it is rendered ("-" writes to stdout) unless a budget
+    needs the whole document first. For markdown, returns the token
+    report of render_markdown, which also explains the other arguments.
+    """
+    diagram = read_diagram(input_file, authors)
+    if output_format == 'markdown':
+        if budget is not None:
+            # Fitting a budget needs every section's size before writing.
+            markdown, report = render_markdown(diagram, style, budget, over_budget)
+            write_markdown_file(output_file, markdown)
+            return report
+        report = []
+
+        def counted(blocks):
+            for title, text, kind, _ in blocks:
+                report.append({'section': title, 'tokens': count_tokens(text), 'style': kind})
+                yield text
+
+        write_sections(counted(iter_blocks(diagram, style)), output_file)
+        return report
+    compile_call_flow(diagram).save(output_file, binary=output_format == 'binary')
+    return None
+
+def print_token_report(report):
+    for entry in sorted(report, key=lambda entry: -entry['tokens']):
+        print(f"{entry['tokens']:>8}  {entry['style']:<8} {entry['section']}")
+    print(f"{sum(entry['tokens'] for entry in report):>8}  total")
+
+# Bump when the rendering changes, so caches written by an older version
+# are not reused.
+SECTION_CACHE_VERSION = 1
+
+
+def file_digest(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_section_cache(cache_file, authors):
+    '''
+    Sections cached by a previous incremental run, or an empty cache if
+    there is none or it was written for other authors or another version.
+    '''
+    empty = {'input': None, 'sections': {}}
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return empty
+    if cache.get('version') != SECTION_CACHE_VERSION or cache.get('authors') != list(authors or ()):
+        return empty
+    return cache
+
+def save_section_cache(cache_file, authors, input_digest, sections):
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({
+            'version': SECTION_CACHE_VERSION,
+            'authors': list(authors or ()),
+            'input': input_digest,
+            'sections': sections
+        }, f)
+    os.replace(tmp_file, cache_file)
+
+def convert_diagram_incremental(input_file, output_file, cache_file=None, authors=DEFAULT_AUTHORS):
+    """
+    Convert diagram file to markdown file, re-rendering only the sections
+    whose inputs changed since the last run. Each section is keyed by a
+    hash of its node's title, content and directives and of the decisions
+    it reaches; rendered sections are kept in `cache_file` (next to the
+    output by default). Returns the titles of the changed, added and
+    removed sections and the number of unchanged ones.
+    """
+    cache_file = cache_file or output_file + '.cache.json'
+    input_digest = file_digest(input_file)
+    cache = load_section_cache(cache_file, authors)
+    previous = cache['sections']
+    if cache['input'] == input_digest and os.path.exists(output_file):
+        return {'changed': [], 'added': [], 'removed': [], 'unchanged': len(previous)}
+
+    diagram = read_diagram(input_file, authors)
+    graph = FlowGraph(diagram)
+    graph.log_problems()
+    report = {'changed': [], 'added': [], 'removed': [], 'unchanged': 0}
+    sections = {}
+    output = []
+    for node_id, node in diagram.nodes.items():
+        if node.type not in ('process', 'terminator'):
+            continue
+        digest = graph.section_digest(node)
+        title = node.title.strip() or node_id
+        cached = previous.get(node_id)
+        if cached is not None and cached[0] == digest:
+            text = cached[2]
+            report['unchanged'] += 1
+        else:
+            text = render_section(node, graph)
+            report['changed' if cached is not None else 'added'].append(title)
+        sections[node_id] = [digest, title, text]
+        if text:
+            output.append(text)
+    report['removed'] = [entry[1] for node_id, entry in previous.items() if node_id not in sections]
+    write_markdown_file(output_file, '\n'.join(output))
+    save_section_cache(cache_file, authors, input_digest, sections)
+    return report
+
+def print_change_report(report):
+    for kind in ('changed', 'added', 'removed'):
+        for title in report[kind]:
+            print(f"{kind:>8}: {title}")
+    print(f"{len(report['changed'])} changed, {len(report['added'])} added, "
+          f"{len(report['removed'])} removed, {report['unchanged']} unchanged")
+
+def collect_inputs(sources, pattern='*.csv'):
+    """
+    Diagram files named by `sources`: files as they are, every file
+    matching `pattern` in a directory, and glob patterns expanded (with **
+    for subdirectories). Each file is listed once, in a stable order.
+    """
+    import glob
+
+    found = []
+    for source in sources:
+        if os.path.isdir(source):
+            matches = sorted(glob.glob(os.path.join(source, pattern)))
+        elif glob.has_magic(source):
+            matches = sorted(glob.glob(source, recursive=True))
+        else:
+            matches = [source]
+        found.extend(path for path in matches if not os.path.isdir(path))
+    return list(dict.fromkeys(found))
+
+def plan_outputs(inputs, output_dir, extension='.md'):
+    """
+    Map each input to OUTPUT_DIR/<name><extension>. Raises ValueError when two
+    inputs would write the same output.
+    """
+    outputs = {}
+    for input_file in inputs:
+        name = os.path.splitext(os.path.basename(input_file))[0] + extension
+        output_file = os.path.join(output_dir, name)
+        if output_file in outputs.values():
+            other = next(i for i, o in outputs.items() if o == output_file)
+            raise ValueError(f"{input_file} and {other} would both write {output_file}")
+        outputs[input_file] = output_file
+    return outputs
+
+def limit_memory(max_memory_mb):
+    """
+    Process pool initializer: cap the worker's address space so one huge
+    diagram fails with MemoryError instead of exhausting the machine.
     """
-    with open(filename, 'w') as f:
-        f.write(content)
+    if not max_memory_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = int(max_memory_mb) * 2**20
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
 
-def convert_diagram(input_file, output_file):
+def convert_job(input_file, output_file, authors, incremental=False, output_format='markdown',
+                markdown_options=None):
     """
-    Convert diagram file to markdown file
+    Convert one file for convert_many. Never raises: returns a result with
+    `ok`, `seconds` and either `error` or, for incremental runs, the
+    change `report`, and the markdown's `tokens`. `markdown_options` are
+    the style, budget and over_budget arguments of convert_diagram.
     """
-    diagram_json = read_diagram_file(input_file)
-    #from pprint import pprint
-    #pprint(diagram_json)
-    markdown = convert_lucid_diagram_to_md(diagram_json)
-    write_markdown_file(output_file, markdown)
+    start = time.perf_counter()
+    result = {'input': input_file, 'output': output_file, 'ok': True, 'error': None, 'report': None,
+              'tokens': None}
+    try:
+        if incremental:
+            result['report'] = convert_diagram_incremental(input_file, output_file, None, authors)
+        else:
+            tokens = convert_diagram(input_file, output_file, authors, output_format, **(markdown_options or {}))
+            if tokens is not None:
+                result['tokens'] = sum(entry['tokens'] for entry in tokens)
+    except MemoryError:
+        result.update(ok=False, error='out of memory')
+    except Exception as e:
+        result.update(ok=False, error=f'{type(e).__name__}: {e}')
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def convert_many(outputs, authors=DEFAULT_AUTHORS, jobs=None, max_tasks_per_child=None,
+                 max_memory_mb=None, incremental=False, on_result=None, output_format='markdown',
+                 markdown_options=None):
+    """
+    Convert every input -> output pair in `outputs` with a pool of `jobs`
+    worker processes (default: one per core). Workers are replaced after
+    `max_tasks_per_child` files and limited to `max_memory_mb` of address
+    space when given. `on_result(result)` is called as each file finishes.
+    Returns the convert_job results in input order.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from concurrent.futures.process import BrokenProcessPool
+
+    jobs = jobs or os.cpu_count() or 1
+    results = {}
+
+    def finish(result):
+        results[result['input']] = result
+        if on_result:
+            on_result(result)
+
+    if jobs == 1 and not max_memory_mb and not max_tasks_per_child:
+        for input_file, output_file in outputs.items():
+            finish(convert_job(input_file, output_file, authors, incremental, output_format,
+                               markdown_options))
+        return [results[input_file] for input_file in outputs]
+
+    options = {'max_workers': min(jobs, len(outputs) or 1),
+               'initializer': limit_memory, 'initargs': (max_memory_mb,)}
+    if max_tasks_per_child:
+        options['max_tasks_per_child'] = max_tasks_per_child
+    with ProcessPoolExecutor(**options) as pool:
+        futures = {
+            pool.submit(convert_job, input_file, output_file, authors, incremental, output_format,
+                        markdown_options): input_file
+            for input_file, output_file in outputs.items()
+        }
+        for future in as_completed(futures):
+            input_file = futures[future]
+            try:
+                finish(future.result())
+            except BrokenProcessPool:
+                # A worker died outright, e.g. killed by the OOM killer.
+                finish({'input': input_file, 'output': outputs[input_file], 'ok': False,
+                        'error': 'worker process died', 'report': None, 'tokens': None,
+                        'seconds': 0.0})
+    return [results[input_file] for input_file in outputs]
+
+def print_result(result):
+    status = 'ok' if result['ok'] else 'FAILED'
+    line = f"{status:>6} {result['seconds']:>7.2f}s  {result['input']} -> {result['output']}"
+    if result['error']:
+        line += f"  ({result['error']})"
+    elif result['report'] is not None:
+        report = result['report']
+        line += (f"  ({len(report['changed'])} changed, {len(report['added'])} added, "
+                 f"{len(report['removed'])} removed)")
+    elif result['tokens'] is not None:
+        line += f"  ({result['tokens']} tokens)"
+    print(line, flush=True)
+
+def print_batch_summary(results, elapsed):
+    failed = [result for result in results if not result['ok']]
+    busy = sum(result['seconds'] for result in results)
+    print(f"{len(results) - len(failed)} converted, {len(failed)} failed in {elapsed:.2f}s "
+          f"({busy:.2f}s of conversion)")
+    for result in failed:
+        print(f"FAILED {result['input']}: {result['error']}")
 
 def main():
     """
@@ -296,12 +1081,68 @@ def main():
     import argparse
 
     parser = argparse.ArgumentParser(description='Convert Lucidchart diagram to markdown')
-    parser.add_argument('input', help='Input diagram file path')
-    parser.add_argument('output', help='Output markdown file path')
+    parser.add_argument('input', nargs='?', help='Input diagram file path')
+    parser.add_argument('output', nargs='?', help='Output markdown file path, or - for stdout')
+    parser.add_argument('--author', action='append', dest='authors',
+                        help='Read directives from comments by this author; repeat for several '
+                             '(default: $DIAGRAM_AUTHORS or Jeremy Villalobos)')
+    parser.add_argument('--any-author', action='store_true',
+                        help='Read directives from every comment, whoever wrote it')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only re-render sections that changed since the last run and list them')
+    parser.add_argument('--cache', help='Section cache for --incremental (default: OUTPUT.cache.json)')
+    parser.add_argument('--format', choices=list(OUTPUT_FORMATS), default='markdown',
+                        help='markdown, or the call-flow state machine as json or binary')
+    parser.add_argument('--style', choices=list(STYLES), default='full',
+                        help='Markdown style: compact writes shorter lines and shares repeated questions')
+    parser.add_argument('--token-budget', type=int, metavar='TOKENS',
+                        help='Warn about or compact (see --over-budget) markdown over this size')
+    parser.add_argument('--over-budget', choices=('warn', 'compact'), default='warn',
+                        help='What to do with markdown over --token-budget (default: warn)')
+    parser.add_argument('--token-report', action='store_true',
+                        help='Print the size of each markdown section in tokens')
+    batch = parser.add_argument_group(
+        'batch mode', 'Convert many diagrams in parallel: --batch SOURCE... --out-dir DIR')
+    batch.add_argument('--batch', nargs='+', metavar='SOURCE',
+                       help='Diagram files, directories (their *.csv files) or glob patterns')
+    batch.add_argument('--out-dir', help='Directory for the <name>.md (or .flow.json, .flow.bin) outputs')
+    batch.add_argument('--jobs', type=int, help='Worker processes (default: one per core)')
+    batch.add_argument('--max-tasks-per-child', type=int,
+                       help='Replace each worker after this many files')
+    batch.add_argument('--max-memory', type=int, metavar='MB',
+                       help='Address space limit per worker, in MiB')
     
     args = parser.parse_args()
+    authors = None if args.any_author else tuple(args.authors or DEFAULT_AUTHORS or ()) or None
     
-    convert_diagram(args.input, args.output)
+    if args.incremental and (args.format != 'markdown' or args.style != 'full' or args.token_budget):
+        parser.error('--incremental only applies to full style markdown output without a budget')
+    markdown_options = {'style': args.style, 'budget': args.token_budget, 'over_budget': args.over_budget}
+    if args.batch:
+        if args.input or args.output or not args.out_dir or args.cache:
+            parser.error('--batch takes --out-dir instead of input, output and --cache')
+        try:
+            outputs = plan_outputs(collect_inputs(args.batch), args.out_dir, OUTPUT_FORMATS[args.format])
+        except ValueError as e:
+            parser.error(str(e))
+        if not outputs:
+            parser.error('no diagram files found')
+        os.makedirs(args.out_dir, exist_ok=True)
+        start = time.perf_counter()
+        results = convert_many(outputs, authors, args.jobs, args.max_tasks_per_child,
+                               args.max_memory, args.incremental, print_result, args.format,
+                               markdown_options)
+        print_batch_summary(results, time.perf_counter() - start)
+        return 1 if any(not result['ok'] for result in results) else 0
+    if not (args.input and args.output):
+        parser.error('input and output are required unless --batch is given')
+
+    if args.incremental:
+        print_change_report(convert_diagram_incremental(args.input, args.output, args.cache, authors))
+    else:
+        report = convert_diagram(args.input, args.output, authors, args.format, **markdown_options)
+        if args.token_report and report is not None:
+            print_token_report(report)
 
 if __name__ == '__main__':
-    main()
+    raise SystemExit(main())